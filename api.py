@@ -1,15 +1,59 @@
 """Модуль API"""
 
 import re
+import codecs
+import time
+import asyncio
+import anyio
+import inspect
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
-from fastapi.responses import JSONResponse
-from argon2 import PasswordHasher
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from uuid import uuid4
-from fastapi import FastAPI, HTTPException, Header, Request
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Header, Request, Response, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from database import database_connection
+from peewee import JOIN, IntegrityError, Value
+from playhouse.mysql_ext import Match
+from database import database_connection, get_pool_stats, count_queries
+from config import (
+    API_THREADPOOL_SIZE,
+    TOKEN_LIFETIME_MINUTES,
+    TOKEN_REFRESH_AFTER_MINUTES,
+    TOKEN_FLUSH_INTERVAL,
+    TOKEN_REAPER_INTERVAL,
+    AUTH_MODE,
+    DEFAULT_PAGE_SIZE,
+    ANKETA_BATCH_LIMIT,
+    SLOW_REQUEST_QUERIES,
+    SLOW_REQUEST_DB_MS,
+    METRICS_FLUSH_INTERVAL,
+    EVENT_KEEPALIVE_INTERVAL,
+)
+from hashing import hash_password, verify_password, needs_rehash, start_executor, shutdown_executor
+from sessions import (
+    session_cache,
+    token_extensions,
+    flush_token_extensions,
+    enforce_session_limit,
+    reap_expired_tokens,
+)
+import signed_tokens
+from pagination import paginate, page_response, page_size, keyset_condition, encode_cursor, decode_cursor
+from streaming import iter_query_rows, stream_json_array, stream_csv, stream_ndjson, gzip_stream
+from versions import collection_versions, etag_matches, CARS, STAMPS, MODELS
+import inventory
+from events import broker
+import vins
+import bulk_import
+import metrics
+from lookups import (statuses, roles, stamps, car_models, resolve_car_dimensions,
+                     warm_up_lookups, get_lookup_stats)
 from models import (
     Users,
     UserToken,
@@ -21,43 +65,134 @@ from models import (
     Shopping,
     Sales,
     Anketa,
-    Status
+    CarSearch,
+    CarCatalog
 )
 
 
-app = FastAPI()
+class DatabaseRoute(APIRoute):
+    """Маршрут, который выполняет синхронный обработчик внутри соединения из пула.
+
+    Синхронные обработчики FastAPI запускает в пуле потоков, поэтому запросы
+    к БД не блокируют event loop. Соединение берется и возвращается в том же
+    потоке, в котором работает обработчик.
+    """
 
-ph = PasswordHasher()
+    def __init__(self, path, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = database_connection.connection_context()(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+async def run_periodically(interval: int, func):
+    """Фоновый запуск синхронной функции раз в interval секунд.
+
+    Ошибка одного запуска журналируется и не останавливает следующие.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(func)
+        except Exception:
+            logger.exception("Ошибка фоновой задачи %s", func.__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Настройка пулов и фоновых задач на время работы приложения"""
+    to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    await run_in_threadpool(start_executor)
+    await run_in_threadpool(warm_up_lookups)
+    await run_in_threadpool(vins.load_vin_filter)
+    broker.bind(asyncio.get_running_loop())
+    background_tasks = [
+        asyncio.create_task(run_periodically(TOKEN_FLUSH_INTERVAL, flush_token_extensions)),
+        asyncio.create_task(run_periodically(TOKEN_REAPER_INTERVAL, reap_expired_tokens)),
+        asyncio.create_task(run_periodically(METRICS_FLUSH_INTERVAL, metrics.write_snapshot)),
+    ]
+    yield
+    broker.bind(None)
+    for task in background_tasks:
+        task.cancel()
+    await run_in_threadpool(metrics.write_snapshot)
+    await run_in_threadpool(flush_token_extensions)
+    shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = DatabaseRoute
+
+logger = logging.getLogger(__name__)
+
+
+def collect_cache_metrics() -> dict:
+    """Счетчики попаданий в кэш сессий и справочников для /metrics"""
+    lookup_stats = get_lookup_stats()["tables"].values()
+    return {
+        "session_cache_hits_total": session_cache.hits,
+        "session_cache_misses_total": session_cache.misses,
+        "lookup_cache_hits_total": sum(table["hits"] for table in lookup_stats),
+        "lookup_cache_misses_total": sum(table["misses"] for table in lookup_stats),
+    }
+
+
+metrics.collectors.append(collect_cache_metrics)
 
 EMAIL_REGEX = r'^[A-Za-zА-Яа-яЁё0-9._%+-]+@[A-Za-zА-Яа-яЁё-]+\.[A-Za-zА-Яа-яЁё-]{2,10}$'
 PHONE_REGEX = r'^[0-9+()\-#]{10,15}$'
 
+TOKEN_LIFETIME = timedelta(minutes=TOKEN_LIFETIME_MINUTES)
+TOKEN_REFRESH_AFTER = timedelta(minutes=TOKEN_REFRESH_AFTER_MINUTES)
+
 
 def get_user_by_token(token: str, role: Optional[str] = None) -> Users:
+    """Пользователь по токену.
+
+    Возвращает модель Users, в которой заполнен только id: полные данные
+    профиля загружают те обработчики, которым они нужны. Сессия берется
+    из кэша, а при промахе загружается из БД одним запросом вместе с ролью.
+    Срок действия продлевается, только если с прошлого продления прошло
+    TOKEN_REFRESH_AFTER, а запись в БД откладывается до фоновой пачки.
+    В режиме AUTH_MODE="signed" токен проверяется по подписи без запросов к БД.
+    """
     try:
-        user_token = (UserToken.select().join(Users).where(
-            (UserToken.token==token) &
-            (UserToken.expires_at > datetime.now()) 
-        ).first())
-        
-        if not user_token:
-            raise HTTPException(401, 'Недействительный или просроченный токен.')
-               
-        user = user_token.user_id
-        user_role = (Roles
-                    .select()
-                    .join(UserRoles, on=(UserRoles.role_id == Roles.id))
-                    .where(UserRoles.user_id == user)
-                    .first())
+        if AUTH_MODE == "signed":
+            claims = signed_tokens.read_token(token)
+            if claims is None:
+                raise HTTPException(401, 'Недействительный или просроченный токен.')
+            if role and claims.role != role:
+                raise HTTPException(status_code=403, detail='Недостаточно прав для выполнения этого действия.')
+            return Users(id=claims.user_id)
+
+        session = session_cache.get(token)
+        if session is None:
+            user_token = (UserToken
+                          .select(UserToken.user_id, UserToken.expires_at, Roles.name.alias('role'))
+                          .join(UserRoles, JOIN.LEFT_OUTER, on=(UserRoles.user_id == UserToken.user_id))
+                          .join(Roles, JOIN.LEFT_OUTER, on=(UserRoles.role_id == Roles.id))
+                          .where(
+                              (UserToken.token==token) &
+                              (UserToken.expires_at > datetime.now())
+                          )
+                          .dicts()
+                          .first())
+
+            if not user_token:
+                raise HTTPException(401, 'Недействительный или просроченный токен.')
+            session = session_cache.put(token, user_token['user_id'], user_token['role'], user_token['expires_at'])
+
         if role:
-           if user_role.name != role:
+           if session.role != role:
                 raise HTTPException(status_code=403, detail='Недостаточно прав для выполнения этого действия.')
-        
-        user_token.expires_at = datetime.now() + timedelta(hours=1)
-        user_token.save()
-        
-        return user
-    
+
+        now = datetime.now()
+        if session.expires_at - now <= TOKEN_LIFETIME - TOKEN_REFRESH_AFTER:
+            expires_at = now + TOKEN_LIFETIME
+            token_extensions.schedule(token, expires_at)
+            session_cache.put(token, session.user_id, session.role, expires_at)
+
+        return Users(id=session.user_id)
+
     except HTTPException as http_exc:
         raise http_exc
 
@@ -132,6 +267,79 @@ class SalesCreate(BaseModel):
     price: int
 
 
+class AnketaBatch(BaseModel):
+    ids: List[int]
+
+
+class CarFilters(BaseModel):
+    """Фильтры и сортировка каталога автомобилей (параметры запроса)"""
+    stamp: Optional[str] = None
+    model: Optional[str] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    min_run: Optional[int] = None
+    max_run: Optional[int] = None
+    sort: Optional[str] = None
+
+
+CAR_SORTS = {
+    "price_asc": ([CarCatalog.price, CarCatalog.id], False),
+    "price_desc": ([CarCatalog.price, CarCatalog.id], True),
+    "run_asc": ([CarCatalog.run_km, CarCatalog.id], False),
+    "run_desc": ([CarCatalog.run_km, CarCatalog.id], True),
+}
+
+
+def filter_cars(query, filters: CarFilters):
+    """Добавить к запросу по CarCatalog условия фильтров"""
+    if filters.stamp:
+        query = query.where(CarCatalog.stamp == filters.stamp)
+    if filters.model:
+        query = query.where(CarCatalog.model_car == filters.model)
+    if filters.min_price is not None:
+        query = query.where(CarCatalog.price >= filters.min_price)
+    if filters.max_price is not None:
+        query = query.where(CarCatalog.price <= filters.max_price)
+    if filters.min_run is not None:
+        query = query.where(CarCatalog.run_km >= filters.min_run)
+    if filters.max_run is not None:
+        query = query.where(CarCatalog.run_km <= filters.max_run)
+    return query
+
+
+def car_ordering(sort: Optional[str]):
+    """Поля сортировки и направление для параметра sort"""
+    if not sort:
+        return [CarCatalog.id], False
+    if sort not in CAR_SORTS:
+        raise HTTPException(400, f'Неизвестная сортировка. Допустимые значения: {", ".join(CAR_SORTS)}')
+    return CAR_SORTS[sort]
+
+
+def all_cars_query():
+    """Все автомобили с названиями марки, модели и статуса из витрины каталога"""
+    return (CarCatalog
+            .select(CarCatalog.id, CarCatalog.stamp, CarCatalog.model_car.alias('model'),
+                    CarCatalog.run_km, CarCatalog.vin, CarCatalog.status, CarCatalog.price,
+                    CarCatalog.description)
+            .dicts())
+
+
+def stream_response(query, format_row=None) -> StreamingResponse:
+    """Отдать весь результат запроса JSON-массивом по мере чтения строк"""
+    return StreamingResponse(stream_json_array(iter_query_rows(query), format_row),
+                             media_type="application/json")
+
+
+def check_not_modified(response: Response, if_none_match: Optional[str], *collections):
+    """Проставить ETag по версиям коллекций; вернуть ответ 304, если у клиента актуальная копия"""
+    etag = collection_versions.etag(*collections)
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(req: Request, exc: Exception):
     """Глобальный обработчик всех необработанных исключений в приложении"""
@@ -144,8 +352,54 @@ async def global_exception_handler(req: Request, exc: Exception):
     )
 
 
+@app.middleware("http")
+async def query_timing_middleware(req: Request, call_next):
+    """Подсчет SQL-запросов и времени работы с БД для каждого запроса к API.
+
+    Результат отдается в заголовках X-DB-Queries и Server-Timing, а запросы,
+    превысившие SLOW_REQUEST_QUERIES или SLOW_REQUEST_DB_MS, журналируются.
+    Здесь же обновляются метрики запросов для /metrics.
+    """
+    started = time.perf_counter()
+    metrics.http_requests_in_flight.inc()
+    status = 500
+    try:
+        with count_queries() as stats:
+            response = await call_next(req)
+        status = response.status_code
+    finally:
+        metrics.http_requests_in_flight.dec()
+        duration = time.perf_counter() - started
+        route = req.scope.get("route")
+        route_path = route.path if route else "unmatched"
+        metrics.http_requests_total.inc(req.method, route_path, str(status))
+        metrics.http_request_duration_seconds.observe(duration, req.method, route_path)
+        metrics.db_queries_total.inc(route_path, amount=stats.count)
+        metrics.db_request_duration_seconds.observe(stats.duration, route_path)
+
+    total_ms = duration * 1000
+    db_ms = stats.duration * 1000
+
+    response.headers["X-DB-Queries"] = str(stats.count)
+    response.headers["Server-Timing"] = (
+        f'db;dur={db_ms:.1f};desc="{stats.count} queries", app;dur={total_ms:.1f}'
+    )
+    if ((SLOW_REQUEST_QUERIES and stats.count >= SLOW_REQUEST_QUERIES) or
+            (SLOW_REQUEST_DB_MS and db_ms >= SLOW_REQUEST_DB_MS)):
+        logger.warning("%s %s: %d SQL-запросов, БД %.1f мс, всего %.1f мс",
+                       req.method, req.url.path, stats.count, db_ms, total_ms)
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(await run_in_threadpool(metrics.render_metrics),
+                             media_type="text/plain; version=0.0.4")
+
+
 @app.post('/users/register/', tags=['Users'])
-async def register_users(user: Registration):
+def register_users(user: Registration):
     """"Регистрация нового пользователя"""
     if not re.fullmatch(EMAIL_REGEX, user.email) or not re.fullmatch(PHONE_REGEX, user.phone):
         raise HTTPException(400, 'Неверный формат данных email/номера телефона')
@@ -155,9 +409,9 @@ async def register_users(user: Registration):
         if existing_user:
             raise HTTPException(403, 'Пользователь с таким email/номером телефона уже существует.')
 
-        hashed_password = ph.hash(user.password)
+        hashed_password = hash_password(user.password)
         with database_connection.atomic():
-            user_role = Roles.get(Roles.name=='Пользователь')
+            user_role_id = roles.get_id('Пользователь')
             user, _ = Users.get_or_create(
                 email=email,
                 phone=user.phone,
@@ -166,7 +420,7 @@ async def register_users(user: Registration):
             )
             UserRoles.create(
                 user_id=user.id,
-                role_id=user_role.id)
+                role_id=user_role_id)
 
         return {'message': 'Вы успешно зарегистрировались!'}
     except HTTPException as http_exc:
@@ -174,7 +428,7 @@ async def register_users(user: Registration):
 
 
 @app.post('/users/auth/', tags=['Users'])
-async def auth_user(data: AuthRequest):
+def auth_user(data: AuthRequest):
     """Аутентификация пользователя"""
 
     email = data.email.lower()
@@ -198,19 +452,36 @@ async def auth_user(data: AuthRequest):
         existing_user = query.first() if query else None
         if not existing_user:
             raise HTTPException(404, 'Пользователя с таким email/номером телефона не  существует.')
-        try:
-            ph.verify(existing_user.password, password)
-        except:
+        if not verify_password(existing_user.password, password):
             raise HTTPException(401, 'Вы ввели неправильный пароль! Попробуйте еще раз.')
-        
-        token = str(uuid4())
-        expires_at = datetime.now() + timedelta(hours=1)
-        
-        UserToken.create(
-            user_id=existing_user.id,
-            token=token,
-            expires_at=expires_at
-        )
+
+        if needs_rehash(existing_user.password):
+            (Users
+             .update(password=hash_password(password))
+             .where(Users.id == existing_user.id)
+             .execute())
+
+        expires_at = datetime.now() + TOKEN_LIFETIME
+
+        if AUTH_MODE == "signed":
+            user_role = (Roles
+                        .select(Roles.name)
+                        .join(UserRoles, on=(UserRoles.role_id == Roles.id))
+                        .where(UserRoles.user_id == existing_user.id)
+                        .first())
+            token = signed_tokens.issue_token(
+                existing_user.id,
+                user_role.name if user_role else None,
+                expires_at.timestamp()
+            )
+        else:
+            token = str(uuid4())
+            UserToken.create(
+                user_id=existing_user.id,
+                token=token,
+                expires_at=expires_at
+            )
+            enforce_session_limit(existing_user.id)
         
         return {'message': 'Успешная авторизация!',
                 'token': token,
@@ -221,20 +492,23 @@ async def auth_user(data: AuthRequest):
 
 
 @app.delete('/users/delete_me/', tags=['Users'])
-async def delete_profile(token: str = Header(...)):
+def delete_profile(token: str = Header(...)):
     """Удаления аккаунта"""
     user = get_user_by_token(token, "Пользователь")
     if not user:
         raise HTTPException(401, 'Не удалось найти пользователя.')
     user.delete_instance()
+    session_cache.invalidate_user(user.id)
+    signed_tokens.denylist.revoke_user(user.id)
     return {'message': 'Пользователь успешно удален.'}
 
 
 @app.get('/users/me/', tags=['Users'])
-async def get_profile(token: str = Header(...)):
+def get_profile(token: str = Header(...)):
     """Получение своей информации пользователем"""
     try:
-        user = get_user_by_token(token)
+        current_user = get_user_by_token(token)
+        user = Users.get_or_none(Users.id == current_user.id)
         if not user:
             raise HTTPException(401, 'Не удалось найти пользователя.')
         return {
@@ -248,7 +522,7 @@ async def get_profile(token: str = Header(...)):
     
 
 @app.put("/users/me/", tags=["Users"])
-async def update_profile(user_data: UserUpdate, token: str = Header(...)):
+def update_profile(user_data: UserUpdate, token: str = Header(...)):
     """Обновление профиля пользователя"""
     current_user = get_user_by_token(token)
     
@@ -261,37 +535,37 @@ async def update_profile(user_data: UserUpdate, token: str = Header(...)):
             if existing_phone and existing_phone.id != current_user.id:
                 raise HTTPException(400, 'Номер телефона уже используется')
         
+        # current_user содержит только id, поэтому пишем лишь переданные поля
+        changes = {}
         if user_data.full_name:
-            current_user.full_name = user_data.full_name
+            changes[Users.full_name] = user_data.full_name
         if user_data.phone:
-            current_user.phone = user_data.phone
-            
-        current_user.save()
+            changes[Users.phone] = user_data.phone
+
+        if changes:
+            Users.update(changes).where(Users.id == current_user.id).execute()
         return {"message": "Профиль успешно обновлен"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.put("/users/me/password", tags=["Users"])
-async def reboot_password(password: PasswordChange, token: str = Header(...)):
+def reboot_password(password: PasswordChange, token: str = Header(...)):
     """Endpoint для изменение пользовательского пароля"""
     current_user = get_user_by_token(token)
     try:
     
         user = Users.get(Users.id==current_user.id)
-        hash_password = ph.hash(password.password)
-        user.password = hash_password
+        user.password = hash_password(password.password)
         user.save()
 
-        ph.verify(hash_password, password.password)
-
         return {"message": "пароль успешно изменен"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.post("/users/anketa/create", tags=["Users"])
-async def create_anket(anketa: AnketaUsersSales, token: str = Header(...)):
+def create_anket(anketa: AnketaUsersSales, token: str = Header(...)):
     """ Endpoint для создания анкеты на продажу авто фирме"""
 
     current_user = get_user_by_token(token)
@@ -299,30 +573,33 @@ async def create_anket(anketa: AnketaUsersSales, token: str = Header(...)):
     try:
         if not current_user:
             raise HTTPException(404, 'Пользователь не найден ')
-        vin_number = Anketa.select().where(Anketa.vin == anketa.vin).first()
-        if vin_number:
+        vin_owner = vins.find_vin(anketa.vin)
+        if vin_owner:
+            if vin_owner['car_id']:
+                raise HTTPException(402, 'Автомобиль с таким VIN уже существует в базе')
             raise HTTPException(402, 'Анкета для этого автомобиля уже существует')
 
-
-        existing_car = Cars.select().where(Cars.vin == anketa.vin).first()
-        if existing_car:
-            raise HTTPException(402, 'Автомобиль с таким VIN уже существует в базе')
-        Anketa.create(
-            user_id = current_user.id,
-            stamp = anketa.stamp,
-            model_car = anketa.model_car,
-            run = anketa.run,
-            price = anketa.price,
-            vin = anketa.vin,
-            description = anketa.description
-        )
+        try:
+            with database_connection.atomic():
+                created = Anketa.create(
+                    user_id = current_user.id,
+                    stamp = anketa.stamp,
+                    model_car = anketa.model_car,
+                    run = anketa.run,
+                    price = anketa.price,
+                    vin = anketa.vin,
+                    description = anketa.description
+                )
+                vins.register_vin(anketa.vin, anketa_id=created.id)
+        except IntegrityError:
+            raise HTTPException(402, 'Анкета или автомобиль с таким VIN уже существует')
         return {'message': 'Анкета успешно создана'}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.delete("/users/anketa/delete", tags=["Users"])
-async def delete_anketa(anketa_id: int , token: str = Header(...)):
+def delete_anketa(anketa_id: int , token: str = Header(...)):
     """Endpoint для удаления пользовательской анкеты"""
     current_user = get_user_by_token(token)
     try:
@@ -343,7 +620,7 @@ async def delete_anketa(anketa_id: int , token: str = Header(...)):
     
 
 @app.put("/users/anketa/update", tags=["Users"])
-async def update_anketa(data: AnketaUpdate, anketa_id: int , token: str = Header(...)):
+def update_anketa(data: AnketaUpdate, anketa_id: int , token: str = Header(...)):
     """Endpoint для изменения анкеты"""
     current_user = get_user_by_token(token)
     try:
@@ -369,189 +646,277 @@ async def update_anketa(data: AnketaUpdate, anketa_id: int , token: str = Header
         if data.price:
             anketa.price = data.price
 
-        if data.vin:
-            vin_number = Anketa.select().where(
-                (Anketa.vin == data.vin) & 
-                (Anketa.id != anketa_id)
-            ).first()
-
-            if vin_number:
+        old_vin = anketa.vin
+        if data.vin and data.vin != old_vin:
+            vin_owner = vins.find_vin(data.vin)
+            if vin_owner and vin_owner['anketa_id'] != anketa_id:
+                if vin_owner['car_id']:
+                    raise HTTPException(402, "Автомобиль с таким VIN уже существует в базе автомобилей")
                 raise HTTPException(402, "Анкета для этого автомобиля уже существует")
-            
-            existing_car = Cars.select().where(Cars.vin == data.vin).first()
-
-            if existing_car:
-                raise HTTPException(402, "Автомобиль с таким VIN уже существует в базе автомобилей")
             anketa.vin = data.vin
 
         if data.description:
             anketa.description = data.description
 
-        anketa.save()
+        try:
+            with database_connection.atomic():
+                anketa.save()
+                if anketa.vin != old_vin:
+                    vins.change_anketa_vin(old_vin, anketa.vin, anketa_id)
+        except IntegrityError:
+            raise HTTPException(402, "Анкета или автомобиль с таким VIN уже существует")
         return {"message": "Анкета успешно обновлена"}
     except HTTPException as http_exc:
         raise http_exc
     
 
 @app.get("/users/anketi/", tags=["Users"])
-async def list_user_anketi(token: str = Header(...)):
+def list_user_anketi(token: str = Header(...)):
     """Endpoint для просмотра анкет пользователя"""
     current_user = get_user_by_token(token)
 
     try:
         if not current_user:
             raise HTTPException(401, "Пользователь не найден")
-        anketi = Anketa.select().where(Anketa.user_id == current_user.id)
+        anketi = list(Anketa
+                      .select(Anketa.id, Anketa.stamp, Anketa.model_car, Anketa.run,
+                              Anketa.price, Anketa.vin, Anketa.description)
+                      .where(Anketa.user_id == current_user.id)
+                      .dicts())
         if not anketi:
             return {"message": "Анкеты отсутствуют"}
-        return [{
-            "id": anketa.id,
-            "stamp": anketa.stamp,
-            "model_car": anketa.model_car,
-            "run": anketa.run,
-            "price": anketa.price,
-            "vin": anketa.vin,
-            "description": anketa.description
-        } for anketa in anketi]
+        return anketi
     except HTTPException as http_exc:
         raise http_exc
     
 
 @app.post("/users/cars/buy", tags=["Users"])
-async def buy_car(car_id: int, token: str = Header(...)):
+def buy_car(car_id: int, token: str = Header(...)):
     """Endpoint для покупки авто пользователем"""
     current_user = get_user_by_token(token)
 
     try:
         if not current_user:
             raise HTTPException(401, 'Не удалось найти пользователя.')
-        car = Cars.select().where(Cars.id == car_id).first()
-        if not car:
-            raise HTTPException(404, "Автомобиль не найден")
-        available_status = Status.get(Status.status == "Доступен")
-        
-        if car.status_id != available_status:
-            raise HTTPException(400, "Этот автомобиль недоступен для покупки")
-
+        # Статус меняется условным UPDATE: из нескольких одновременных
+        # покупателей строку изменит только один, остальные получат 0 строк.
         with database_connection.atomic():
-            Shopping.create(
-                car_id=car.id,
-                buyer_id=current_user.id,
-                price=car.price 
-            )
-
-            sold_status = Status.get(Status.status == "Продан")
-            car.status_id = sold_status
-            car.save()
-
+            sold = (Cars
+                    .update(status_id=statuses.get_id("Продан"))
+                    .where((Cars.id == car_id) & (Cars.status_id == statuses.get_id("Доступен")))
+                    .execute())
+            if not sold:
+                if not Cars.select().where(Cars.id == car_id).exists():
+                    raise HTTPException(404, "Автомобиль не найден")
+                raise HTTPException(400, "Этот автомобиль недоступен для покупки")
+
+            Shopping.insert_from(
+                Cars.select(Cars.id, Value(current_user.id), Cars.price, Value(datetime.now()))
+                .where(Cars.id == car_id),
+                [Shopping.car_id, Shopping.buyer_id, Shopping.price, Shopping.date_buy]).execute()
+            inventory.record_car_changes([car_id], inventory.SOLD)
+
+        collection_versions.bump(CARS)
+        inventory.publish_car_changes([car_id], inventory.SOLD)
         return {"message": "Автомобиль успешно куплен"}
 
     except HTTPException as http_exc:
         raise http_exc
 
 @app.get("/users/cars/available", tags=["Users"])
-async def get_available_cars(token: str = Header(...)):
-    """Получение списка доступных автомобилей"""
+def get_available_cars(response: Response, filters: CarFilters = Depends(),
+                       cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                       if_none_match: Optional[str] = Header(None), token: str = Header(...)):
+    """Получение списка доступных автомобилей с фильтрами и сортировкой (постранично)"""
     current_user = get_user_by_token(token)
     
     try:
-        available_status = Status.get(Status.status == "Доступен")
-        if not available_status:
-            return []
-        cars = (Cars
-                .select(Cars, Stamp, ModelCar)
-                .join(Stamp, on=(Cars.stamp_id == Stamp.id))
-                .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
-                .where(Cars.status_id == available_status.id))
-                
-        return [{
-            "id": car.id,
-            "stamp": car.stamp_id.stamp,
-            "model": car.model_car_id.model_car,
-            "run_km": car.run_km,
-            "vin": car.vin,
-            "price": car.price
-        } for car in cars]
+        not_modified = check_not_modified(response, if_none_match, CARS, STAMPS, MODELS)
+        if not_modified:
+            return not_modified
+        order_fields, descending = car_ordering(filters.sort)
+        query = filter_cars(
+            CarCatalog
+            .select(CarCatalog.id, CarCatalog.stamp, CarCatalog.model_car.alias('model'),
+                    CarCatalog.run_km, CarCatalog.vin, CarCatalog.price)
+            .where(CarCatalog.status == "Доступен")
+            .dicts(),
+            filters)
+        cars, next_cursor = paginate(query, order_fields, cursor, limit, descending)
+        return page_response(cars, next_cursor)
+    except HTTPException as http_exc:
+        raise http_exc
+
+
+@app.get("/users/cars/changes", tags=["Users"])
+def get_car_changes(since: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE,
+                    token: str = Header(...)):
+    """Изменения автомобилей после курсора since (дельта-синхронизация).
+
+    Без since возвращается только текущий курсор: клиент загружает каталог
+    целиком и дальше запрашивает изменения от него. Для действия deleted
+    поле car пустое, для остальных - актуальные данные автомобиля. Изменения
+    последних CAR_CHANGES_SETTLE_SECONDS секунд могут прийти повторно.
+    """
+    get_user_by_token(token)
+    try:
+        if since is None:
+            return {"changes": [], "cursor": inventory.latest_change_id(), "has_more": False}
+        actions, cursor, has_more = inventory.changes_since(since, page_size(limit))
+        cars = {}
+        if actions:
+            cars = {car["id"]: car for car in all_cars_query().where(CarCatalog.id.in_(list(actions)))}
+        return {
+            "changes": [{
+                "car_id": car_id,
+                "action": action,
+                "car": cars.get(car_id) if action != inventory.DELETED else None
+            } for car_id, action in actions.items()],
+            "cursor": cursor,
+            "has_more": has_more
+        }
     except HTTPException as http_exc:
         raise http_exc
 
 
+@app.get("/users/cars/search", tags=["Users"])
+def search_cars(q: str, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                token: str = Header(...)):
+    """Полнотекстовый поиск доступных автомобилей по марке, модели, VIN и описанию.
+
+    Слова запроса ищутся по префиксу, результаты упорядочены по релевантности.
+    """
+    get_user_by_token(token)
+    try:
+        expression = inventory.search_expression(q)
+        if not expression:
+            raise HTTPException(400, "Пустой поисковый запрос")
+        size = page_size(limit)
+        score = Match(CarSearch.document, expression, 'IN BOOLEAN MODE')
+        query = (CarSearch
+                 .select(CarCatalog.id, CarCatalog.stamp, CarCatalog.model_car.alias('model'),
+                         CarCatalog.run_km, CarCatalog.vin, CarCatalog.price, CarCatalog.description,
+                         score.alias('score'))
+                 .join(CarCatalog, on=(CarSearch.car_id == CarCatalog.id))
+                 .where(score, CarCatalog.status == "Доступен"))
+        order_fields = [score, CarCatalog.id]
+        if cursor:
+            query = query.where(keyset_condition(order_fields, decode_cursor(cursor, order_fields), True))
+        cars = list(query.order_by(score.desc(), CarCatalog.id.desc()).limit(size + 1).dicts())
+        next_cursor = None
+        if len(cars) > size:
+            cars = cars[:size]
+            next_cursor = encode_cursor([cars[-1]["score"], cars[-1]["id"]])
+        return page_response(cars, next_cursor)
+    except HTTPException as http_exc:
+        raise http_exc
+
+
+@database_connection.connection_context()
+def check_token(token: str, role: Optional[str] = None) -> Users:
+    """get_user_by_token для асинхронных обработчиков (вызывать через run_in_threadpool)"""
+    return get_user_by_token(token, role)
+
+
+@database_connection.connection_context()
+def get_token_role(token: str) -> Optional[str]:
+    """Проверить токен и вернуть роль его владельца"""
+    get_user_by_token(token)
+    if AUTH_MODE == "signed":
+        return signed_tokens.read_token(token).role
+    session = session_cache.get(token)
+    return session.role if session else None
+
+
+async def event_stream(subscriber):
+    """Сообщения подписчика в формате SSE с периодическим keepalive"""
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), EVENT_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                message = ": keepalive\n\n"
+            yield message
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+@app.get("/events", tags=["Users"])
+async def subscribe_events(types: Optional[str] = None, token: str = Header(...)):
+    """Поток событий об изменениях (Server-Sent Events).
+
+    types - список типов через запятую (cars, anketi); по умолчанию все,
+    доступные роли пользователя. После события resync клиенту нужно
+    догрузить изменения через /users/cars/changes.
+    """
+    role = await run_in_threadpool(get_token_role, token)
+    subscriber = broker.subscribe(role, types.split(",") if types else None)
+    return StreamingResponse(event_stream(subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/users/my_purchases", tags=["Users"])
-async def get_my_purchases(token: str = Header(...)):
+def get_my_purchases(token: str = Header(...)):
     """Получение истории покупок пользователя"""
     current_user = get_user_by_token(token)
     
     try:
-        purchases = (Shopping
-                    .select(Shopping, Cars, Stamp, ModelCar)
-                    .join(Cars, on=(Shopping.car_id == Cars.id))
-                    .join(Stamp, on=(Cars.stamp_id == Stamp.id))
-                    .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
-                    .where(Shopping.buyer_id == current_user.id))
+        purchases = list(Shopping
+                         .select(Shopping.id, Shopping.price, Shopping.date_buy,
+                                 Stamp.stamp, ModelCar.model_car, Cars.vin, Cars.run_km)
+                         .join(Cars, on=(Shopping.car_id == Cars.id))
+                         .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+                         .switch(Cars)
+                         .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
+                         .where(Shopping.buyer_id == current_user.id)
+                         .dicts())
         if not purchases:
             raise HTTPException(404, "Истории покупок пуста")
         return [{
-            "id": purchase.id,
+            "id": purchase["id"],
             "car": {
-                "stamp": purchase.car_id.stamp_id.stamp,
-                "model": purchase.car_id.model_car_id.model_car,
-                "vin": purchase.car_id.vin,
-                "run_km": purchase.car_id.run_km
+                "stamp": purchase["stamp"],
+                "model": purchase["model_car"],
+                "vin": purchase["vin"],
+                "run_km": purchase["run_km"]
             },
-            "price": purchase.price,
-            "date_buy": purchase.date_buy.isoformat()
+            "price": purchase["price"],
+            "date_buy": purchase["date_buy"].isoformat()
         } for purchase in purchases]
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.get("/users/list_users/", tags=["Admin"])
-async def get_list_users(token: str = Header(...)):
-    """Получение список всех пользователей"""
+def get_list_users(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                   stream: bool = False, token: str = Header(...)):
+    """Получение список всех пользователей (постранично или целиком потоком при stream=true)"""
     current_user = get_user_by_token(token, "Администратор")
 
-    users = Users.select().where(Users.id!=current_user.id)
-    if not users:
-        raise HTTPException(404, "Пользователи не найдены")
+    query = (Users
+             .select(Users.id, Users.full_name.alias('name'), Users.email, Users.phone)
+             .where(Users.id!=current_user.id)
+             .dicts())
     try:
-        return [
-            {
-                "id": user.id,
-                "name": user.full_name,
-                "email": user.email,
-                "phone": user.phone,
-            } for user in users
-        ]
+        if stream:
+            return stream_response(query.order_by(Users.id))
+        users, next_cursor = paginate(query, [Users.id], cursor, limit)
+        return page_response(users, next_cursor)
     except HTTPException as http_exc:
         raise http_exc
     
 
 @app.get("/users/cars/{car_id}", tags=["Users"])
-async def get_car_details(car_id: int, token: str = Header(...)):
+def get_car_details(car_id: int, token: str = Header(...)):
     """Получение детальной информации об автомобиле"""
     current_user = get_user_by_token(token)
     try:
-        car = (Cars
-               .select(Cars, Stamp, ModelCar, Status)
-               .join(Stamp)
-               .join(ModelCar)
-               .join(Status)
-               .where(Cars.id == car_id)
-               .first())
+        car = all_cars_query().where(CarCatalog.id == car_id).first()
         
         if not car:
             raise HTTPException(404, "Автомобиль не найден")
         
-        return {
-            "id": car.id,
-            "stamp": car.stamp_id.stamp,
-            "model": car.model_car_id.model_car,
-            "run_km": car.run_km,
-            "vin": car.vin,
-            "status": car.status_id.status,
-            "price": car.price,
-            "description": car.description
-        }
+        return car
     except HTTPException as http_exc:
         raise http_exc
 
@@ -559,7 +924,7 @@ async def get_car_details(car_id: int, token: str = Header(...)):
                     # Функционал Администратора
 
 @app.delete("/admin/users/delete_profile/", tags=["Admin"])
-async def delete_profile_user(user_id: int, token: str = Header(...)):
+def delete_profile_user(user_id: int, token: str = Header(...)):
     """Удаления профиля пользователя"""
 
     current_user = get_user_by_token(token, "Администратор")
@@ -575,125 +940,253 @@ async def delete_profile_user(user_id: int, token: str = Header(...)):
             raise HTTPException(400, 'Аккаунт данного пользователя нельзя удалить.')
         
         user.delete_instance()
+        session_cache.invalidate_user(user.id)
+        signed_tokens.denylist.revoke_user(user.id)
         return {'message': 'Пользователь успешно удален.'}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.get("/admin/anketi/", tags=["Admin"])
-async def get_all_anketi(token: str = Header(...)):
-    """Получение всех анкет для администратора"""
+def get_all_anketi(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                   token: str = Header(...)):
+    """Получение всех анкет для администратора (постранично)"""
     current_user = get_user_by_token(token, "Администратор")
     try:
         if not current_user:
             raise HTTPException(401, 'Недействительный токен.')
-        anketi = (Anketa
-                .select(Anketa, Users)
-                .join(Users))
-        
-        return [{
-            "id": anketa.id,
-            "user_name": anketa.user_id.full_name,
-            "user_phone": anketa.user_id.phone,
-            "stamp": anketa.stamp,
-            "model_car": anketa.model_car,
-            "run": anketa.run,
-            "price": anketa.price,
-            "vin": anketa.vin,
-            "description": anketa.description
-        } for anketa in anketi]
+        anketi, next_cursor = paginate(
+            Anketa
+            .select(Anketa.id, Users.full_name.alias('user_name'), Users.phone.alias('user_phone'),
+                    Anketa.stamp, Anketa.model_car, Anketa.run, Anketa.price, Anketa.vin,
+                    Anketa.description)
+            .join(Users, on=(Anketa.user_id == Users.id))
+            .dicts(),
+            [Anketa.id], cursor, limit)
+        return page_response(anketi, next_cursor)
     except HTTPException as http_exc:
         raise http_exc
 
 
-@app.post("/admin/anketi/{anketa_id}/accept", tags=["Admin"])
-async def accept_anketa(anketa_id: int, token: str = Header(...)):
-    """Принятие анкеты администратором (покупка автомобиля у пользователя)"""
-    current_user = get_user_by_token(token, "Администратор")
+def accept_anketa_row(anketa: Anketa, admin_id: int) -> int:
+    """Перенести анкету в автомобили одной транзакцией; возвращает id автомобиля"""
+    vin_owner = vins.find_vin(anketa.vin)
+    if vin_owner and vin_owner['car_id']:
+        raise HTTPException(400, "Автомобиль с таким VIN уже существует в базе")
 
+    stamp_id, model_car_id = resolve_car_dimensions(anketa.stamp, anketa.model_car)
     try:
-        anketa = Anketa.select().where(Anketa.id == anketa_id).first()
-        if not anketa:
-            raise HTTPException(404, "Анкета не найдена")
+        with database_connection.atomic():
+            car = Cars.create(
+                stamp_id=stamp_id,
+                model_car_id=model_car_id,
+                run_km=anketa.run,
+                vin=anketa.vin,
+                status_id=statuses.get_id("Доступен"),
+                price=anketa.price,
+                description=anketa.description
+            )
+            vins.assign_vin_to_car(anketa.vin, car.id)
+            inventory.record_car_changes([car.id], inventory.ADDED)
 
-        existing_car = Cars.select().where(Cars.vin == anketa.vin).first()
-        if existing_car:
-            raise HTTPException(400, "Автомобиль с таким VIN уже существует в базе")
+            Sales.create(
+                car_id=car.id,
+                buyer_id=admin_id,
+                price=anketa.price
+            )
 
-        stamp, _ = Stamp.get_or_create(
-            stamp=anketa.stamp,
-            defaults={'stamp': anketa.stamp}
-        )
+            anketa.delete_instance()
+    except IntegrityError:
+        raise HTTPException(400, "Автомобиль с таким VIN уже существует в базе")
+    return car.id
 
-        model_car, _ = ModelCar.get_or_create(
-            model_car=anketa.model_car,
-            defaults={'model_car': anketa.model_car}
-        )
 
-        available_status = Status.get(Status.status == "Доступен")
+def publish_accepted_anketi(anketa_ids: list, car_ids: list):
+    """Версии и уведомления после фиксации принятия анкет"""
+    collection_versions.bump(CARS)
+    inventory.publish_car_changes(car_ids, inventory.ADDED)
+    broker.publish("anketi", {"action": "accepted", "anketa_ids": anketa_ids}, roles=["Администратор"])
 
-        car = Cars.create(
-            stamp_id=stamp.id,
-            model_car_id=model_car.id,
-            run_km=anketa.run,
-            vin=anketa.vin,
-            status_id=available_status.id,
-            price=anketa.price,
-            description=anketa.description
-        )
 
-        Sales.create(
-            car_id=car.id,
-            buyer_id=current_user.id,
-            price=anketa.price
-        )
+@app.post("/admin/anketi/accept", tags=["Admin"])
+def accept_anketi(batch: AnketaBatch, token: str = Header(...)):
+    """Пакетное принятие анкет одной транзакцией.
 
-        anketa.delete_instance()
+    Анкеты, которые нельзя принять (не найдена, VIN уже занят автомобилем),
+    попадают в failed с причиной, остальные принимаются вместе. Если
+    транзакция не прошла из-за параллельного изменения, анкеты принимаются
+    по одной, чтобы отделить проблемные.
+    """
+    current_user = get_user_by_token(token, "Администратор")
+
+    try:
+        anketa_ids = list(dict.fromkeys(batch.ids))
+        if len(anketa_ids) > ANKETA_BATCH_LIMIT:
+            raise HTTPException(400, f"Не больше {ANKETA_BATCH_LIMIT} анкет за один запрос")
+
+        anketi = {anketa.id: anketa for anketa in Anketa.select().where(Anketa.id.in_(anketa_ids))}
+        car_vins = {vin for vin, in Cars
+                    .select(Cars.vin)
+                    .where(Cars.vin.in_([anketa.vin for anketa in anketi.values()]))
+                    .tuples()}
+        failed = []
+        pending = []
+        for anketa_id in anketa_ids:
+            anketa = anketi.get(anketa_id)
+            if anketa is None:
+                failed.append({"anketa_id": anketa_id, "reason": "Анкета не найдена"})
+            elif anketa.vin in car_vins:
+                failed.append({"anketa_id": anketa_id,
+                               "reason": "Автомобиль с таким VIN уже существует в базе"})
+            else:
+                pending.append(anketa)
+
+        dimensions = {(anketa.stamp, anketa.model_car): resolve_car_dimensions(anketa.stamp, anketa.model_car)
+                      for anketa in pending}
+        available_status_id = statuses.get_id("Доступен")
+        accepted = []
+        try:
+            with database_connection.atomic():
+                if pending:
+                    Cars.insert_many([{
+                        "stamp_id": dimensions[(anketa.stamp, anketa.model_car)][0],
+                        "model_car_id": dimensions[(anketa.stamp, anketa.model_car)][1],
+                        "run_km": anketa.run,
+                        "vin": anketa.vin,
+                        "status_id": available_status_id,
+                        "price": anketa.price,
+                        "description": anketa.description,
+                    } for anketa in pending]).execute()
+                    car_ids = dict(Cars
+                                   .select(Cars.vin, Cars.id)
+                                   .where(Cars.vin.in_([anketa.vin for anketa in pending]))
+                                   .tuples())
+                    vins.assign_vins_to_cars(car_ids)
+                    inventory.record_car_changes(car_ids.values(), inventory.ADDED)
+                    Sales.insert_many([{
+                        "car_id": car_ids[anketa.vin],
+                        "buyer_id": current_user.id,
+                        "price": anketa.price,
+                    } for anketa in pending]).execute()
+                    Anketa.delete().where(Anketa.id.in_([anketa.id for anketa in pending])).execute()
+                    accepted = [{"anketa_id": anketa.id, "car_id": car_ids[anketa.vin]}
+                                for anketa in pending]
+        except IntegrityError:
+            for anketa in pending:
+                try:
+                    accepted.append({"anketa_id": anketa.id,
+                                     "car_id": accept_anketa_row(anketa, current_user.id)})
+                except HTTPException as exc:
+                    failed.append({"anketa_id": anketa.id, "reason": exc.detail})
+
+        if accepted:
+            publish_accepted_anketi([row["anketa_id"] for row in accepted],
+                                    [row["car_id"] for row in accepted])
+        return {"accepted": accepted, "failed": failed}
+    except HTTPException as http_exc:
+        raise http_exc
+
+
+@app.post("/admin/anketi/{anketa_id}/accept", tags=["Admin"])
+def accept_anketa(anketa_id: int, token: str = Header(...)):
+    """Принятие анкеты администратором (покупка автомобиля у пользователя)"""
+    current_user = get_user_by_token(token, "Администратор")
+
+    try:
+        anketa = Anketa.select().where(Anketa.id == anketa_id).first()
+        if not anketa:
+            raise HTTPException(404, "Анкета не найдена")
+
+        car_id = accept_anketa_row(anketa, current_user.id)
 
+        publish_accepted_anketi([anketa_id], [car_id])
         return {"message": "Анкета принята, автомобиль добавлен в базу"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.post("/admin/cars/", tags=["Admin"])
-async def add_car(car_data: CarsCreated, token: str = Header(...)):
+def add_car(car_data: CarsCreated, token: str = Header(...)):
     """Добавление автомобиля администратором"""
     current_user = get_user_by_token(token, "Администратор")
 
     try:
         if not current_user:
             raise HTTPException(401, 'Недействительный токен.')
-        vin = Cars.select().where(Cars.vin == car_data.vin)
-        if vin:
+        if vins.find_vin(car_data.vin):
+            raise HTTPException(400, "Данный автомобиль уже есть в базе")
+        stamp_id, model_car_id = resolve_car_dimensions(car_data.stamp, car_data.model_car)
+        try:
+            with database_connection.atomic():
+                car = Cars.create(
+                    stamp_id=stamp_id,
+                    model_car_id=model_car_id,
+                    run_km=car_data.run,
+                    vin=car_data.vin,
+                    status_id=statuses.get_id("Доступен"),
+                    price=car_data.price,
+                    description=car_data.description
+                )
+                vins.register_vin(car_data.vin, car_id=car.id)
+                inventory.record_car_changes([car.id], inventory.ADDED)
+        except IntegrityError:
             raise HTTPException(400, "Данный автомобиль уже есть в базе")
-        available_status = Status.get(Status.status == "Доступен")
-        stamp, _ = Stamp.get_or_create(
-            stamp=car_data.stamp,
-            defaults={'stamp': car_data.stamp}
-        )
-
-        model_car, _ = ModelCar.get_or_create(
-            model_car=car_data.model_car,
-            defaults={'model_car': car_data.model_car}
-        )
-
-        car = Cars.create(
-            stamp_id=stamp.id,
-            model_car_id=model_car.id,
-            run_km=car_data.run,
-            vin=car_data.vin,
-            status_id=available_status.id,
-            price=car_data.price,
-            description=car_data.description
-        )
         
+        collection_versions.bump(CARS)
+        inventory.publish_car_changes([car.id], inventory.ADDED)
         return {"message": "Автомобиль успешно добавлен", "car_id": car.id}
     except HTTPException as http_exc:
         raise http_exc
 
 
+@app.post("/admin/cars/bulk", tags=["Admin"])
+async def bulk_import_cars(request: Request, format: Optional[str] = None,
+                           token: str = Header(...)):
+    """Пакетный импорт автомобилей из CSV (с заголовком) или NDJSON.
+
+    Поля: stamp, model_car, run, price, vin, description. Формат задается
+    параметром format или по Content-Type. Файл читается потоком, строки
+    вставляются порциями в отдельных транзакциях; ошибочные строки
+    перечисляются в errors с номером строки.
+    """
+    await run_in_threadpool(check_token, token, "Администратор")
+    data_format = format or ("ndjson" if "json" in request.headers.get("content-type", "") else "csv")
+    if data_format not in bulk_import.FORMATS:
+        raise HTTPException(400, f'Неизвестный формат. Допустимые значения: {", ".join(bulk_import.FORMATS)}')
+
+    lines = bulk_import.LineStream()
+    worker = asyncio.ensure_future(run_in_threadpool(bulk_import.import_cars, lines, data_format))
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    try:
+        async for chunk in request.stream():
+            parts = (tail + decoder.decode(chunk)).split("\n")
+            tail = parts.pop()
+            if parts:
+                await lines.send.send([part + "\n" for part in parts])
+        tail += decoder.decode(b"", final=True)
+        if tail:
+            await lines.send.send([tail])
+    except anyio.BrokenResourceError:
+        # Поток импорта завершился раньше (ошибка БД): ее вернет await worker
+        pass
+    except BaseException:
+        # Клиент отключился или запрос отменен: не вставлять недописанную порцию
+        lines.abort()
+        with anyio.CancelScope(shield=True):
+            try:
+                await worker
+            except bulk_import.ImportAborted:
+                pass
+            except Exception:
+                logger.exception("Ошибка пакетного импорта после обрыва загрузки")
+        raise
+    lines.finish()
+    return await worker
+
+
 @app.put("/admin/cars/{car_id}", tags=["Admin"])
-async def update_car(car_id: int, car_data: CarsUpdate, token: str = Header(...)):
+def update_car(car_id: int, car_data: CarsUpdate, token: str = Header(...)):
     """Обновление информации об автомобиле"""
     current_user = get_user_by_token(token, "Администратор")
 
@@ -707,50 +1200,57 @@ async def update_car(car_id: int, car_data: CarsUpdate, token: str = Header(...)
         if car_data.run:
             car.run_km = car_data.run
         if car_data.status_id:
-            status_exists = Status.get_or_none(Status.id == car_data.status_id)
-            if not status_exists:
+            if not statuses.get_name(car_data.status_id):
                 raise HTTPException(404, "Указанный статус не найден")
             car.status_id = car_data.status_id
         if car_data.description:
             car.description = car_data.description
         
-        car.save()
+        sold = car.status_id_id == statuses.get_id("Продан")
+        with database_connection.atomic():
+            car.save()
+            inventory.record_car_changes([car.id], inventory.SOLD if sold else inventory.UPDATED)
         
+        collection_versions.bump(CARS)
+        inventory.publish_car_changes([car.id], inventory.SOLD if sold else inventory.UPDATED)
         return {"message": "Информация об автомобиле обновлена"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.get("/admin/stamps/", tags=["Users"])
-async def get_all_stamps(token: str = Header(...)):
-    """Получение всех марок автомобилей"""
+def get_all_stamps(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                   if_none_match: Optional[str] = Header(None), token: str = Header(...)):
+    """Получение всех марок автомобилей (постранично)"""
     get_user_by_token(token)
     try:
-        stamps = Stamp.select()
-        return [{
-            "id": stamp.id,
-            "stamp": stamp.stamp
-        } for stamp in stamps]
+        not_modified = check_not_modified(response, if_none_match, STAMPS)
+        if not_modified:
+            return not_modified
+        stamp_rows, next_cursor = paginate(Stamp.select(Stamp.id, Stamp.stamp).dicts(),
+                                           [Stamp.id], cursor, limit)
+        return page_response(stamp_rows, next_cursor)
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.post("/admin/stamps/", tags=["Admin"])
-async def create_stamp(stamp_data: StampCreate, token: str = Header(...)):
+def create_stamp(stamp_data: StampCreate, token: str = Header(...)):
     """Создание новой марки автомобиля"""
     get_user_by_token(token, "Администратор")
     try:
-        existing_stamp = Stamp.select().where(Stamp.stamp == stamp_data.stamp).first()
-        if existing_stamp:
+        if stamps.get_id(stamp_data.stamp):
             raise HTTPException(400, "Марка с таким названием уже существует")
         
         stamp = Stamp.create(stamp=stamp_data.stamp)
+        stamps.invalidate()
+        collection_versions.bump(STAMPS)
         return {"message": "Марка успешно создана", "stamp_id": stamp.id}
     except HTTPException as http_exc:
         raise http_exc
 
 @app.put("/admin/stamps/{stamp_id}", tags=["Admin"])
-async def update_stamp(stamp_id: int, stamp_data: StampCreate, token: str = Header(...)):
+def update_stamp(stamp_id: int, stamp_data: StampCreate, token: str = Header(...)):
     """Обновление марки автомобиля"""
     get_user_by_token(token, "Администратор")
     try:
@@ -763,13 +1263,18 @@ async def update_stamp(stamp_id: int, stamp_data: StampCreate, token: str = Head
             raise HTTPException(400, "Марка с таким названием уже существует")
         
         stamp.stamp = stamp_data.stamp
-        stamp.save()
+        with database_connection.atomic():
+            stamp.save()
+            car_ids = inventory.record_renamed_cars(Cars.stamp_id == stamp_id)
+        stamps.invalidate()
+        collection_versions.bump(STAMPS, CARS)
+        inventory.publish_car_changes(car_ids, inventory.UPDATED)
         return {"message": "Марка успешно обновлена"}
     except HTTPException as http_exc:
         raise http_exc
 
 @app.delete("/admin/stamps/{stamp_id}", tags=["Admin"])
-async def delete_stamp(stamp_id: int, token: str = Header(...)):
+def delete_stamp(stamp_id: int, token: str = Header(...)):
     """Удаление марки автомобиля"""
     get_user_by_token(token, "Администратор")
     try:
@@ -782,42 +1287,47 @@ async def delete_stamp(stamp_id: int, token: str = Header(...)):
             raise HTTPException(400, "Невозможно удалить марку, так как она используется в автомобилях")
         
         stamp.delete_instance()
+        stamps.invalidate()
+        collection_versions.bump(STAMPS)
         return {"message": "Марка успешно удалена"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.get("/admin/models/", tags=["Users"])
-async def get_all_models(token: str = Header(...)):
-    """Получение всех моделей автомобилей"""
+def get_all_models(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                   if_none_match: Optional[str] = Header(None), token: str = Header(...)):
+    """Получение всех моделей автомобилей (постранично)"""
     get_user_by_token(token)
     try:
-        models = ModelCar.select()
-        return [{
-            "id": model.id,
-            "model_car": model.model_car
-        } for model in models]
+        not_modified = check_not_modified(response, if_none_match, MODELS)
+        if not_modified:
+            return not_modified
+        models, next_cursor = paginate(ModelCar.select(ModelCar.id, ModelCar.model_car).dicts(),
+                                       [ModelCar.id], cursor, limit)
+        return page_response(models, next_cursor)
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.post("/admin/models/", tags=["Admin"])
-async def create_model(model_data: ModelCarCreate, token: str = Header(...)):
+def create_model(model_data: ModelCarCreate, token: str = Header(...)):
     """Создание новой модели автомобиля"""
     current_user = get_user_by_token(token, "Администратор")
     try:
-        existing_model = ModelCar.select().where(ModelCar.model_car == model_data.model_car).first()
-        if existing_model:
+        if car_models.get_id(model_data.model_car):
             raise HTTPException(400, "Модель с таким названием уже существует")
         
         model = ModelCar.create(model_car=model_data.model_car)
+        car_models.invalidate()
+        collection_versions.bump(MODELS)
         return {"message": "Модель успешно создана", "model_id": model.id}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.put("/admin/models/{model_id}", tags=["Admin"])
-async def update_model(model_id: int, model_data: ModelCarCreate, token: str = Header(...)):
+def update_model(model_id: int, model_data: ModelCarCreate, token: str = Header(...)):
     """Обновление модели автомобиля"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -830,14 +1340,19 @@ async def update_model(model_id: int, model_data: ModelCarCreate, token: str = H
             raise HTTPException(400, "Модель с таким названием уже существует")
         
         model.model_car = model_data.model_car
-        model.save()
+        with database_connection.atomic():
+            model.save()
+            car_ids = inventory.record_renamed_cars(Cars.model_car_id == model_id)
+        car_models.invalidate()
+        collection_versions.bump(MODELS, CARS)
+        inventory.publish_car_changes(car_ids, inventory.UPDATED)
         return {"message": "Модель успешно обновлена"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.delete("/admin/models/{model_id}", tags=["Admin"])
-async def delete_model(model_id: int, token: str = Header(...)):
+def delete_model(model_id: int, token: str = Header(...)):
     """Удаление модели автомобиля"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -850,68 +1365,44 @@ async def delete_model(model_id: int, token: str = Header(...)):
             raise HTTPException(400, "Невозможно удалить модель, так как она используется в автомобилях")
         
         model.delete_instance()
+        car_models.invalidate()
+        collection_versions.bump(MODELS)
         return {"message": "Модель успешно удалена"}
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.get("/admin/cars/", tags=["Admin"])
-async def get_all_cars(token: str = Header(...)):
-    """Получение всех автомобилей"""
+def get_all_cars(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                 stream: bool = False, token: str = Header(...)):
+    """Получение всех автомобилей (постранично или целиком потоком при stream=true)"""
     current_user = get_user_by_token(token, "Администратор")
     try:
-        cars = (Cars
-                .select(Cars, Stamp, ModelCar, Status)
-                .join(Stamp, on=(Cars.stamp_id == Stamp.id))
-                .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
-                .join(Status, on=(Cars.status_id == Status.id)))
-        
-        return [{
-            "id": car.id,
-            "stamp": car.stamp_id.stamp,
-            "model": car.model_car_id.model_car,
-            "run_km": car.run_km,
-            "vin": car.vin,
-            "status": car.status_id.status,
-            "price": car.price,
-            "description": car.description
-        } for car in cars]
+        if stream:
+            return stream_response(all_cars_query().order_by(CarCatalog.id))
+        cars, next_cursor = paginate(all_cars_query(), [CarCatalog.id], cursor, limit)
+        return page_response(cars, next_cursor)
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.get("/admin/cars/{car_id}", tags=["Admin"])
-async def get_car(car_id: int, token: str = Header(...)):
+def get_car(car_id: int, token: str = Header(...)):
     """Получение информации об автомобиле по ID"""
     current_user = get_user_by_token(token, "Администратор")
     try:
-        car = (Cars
-               .select(Cars, Stamp, ModelCar, Status)
-               .join(Stamp, on=(Cars.stamp_id == Stamp.id))
-               .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
-               .join(Status, on=(Cars.status_id == Status.id))
-               .where(Cars.id == car_id)
-               .first())
+        car = all_cars_query().where(CarCatalog.id == car_id).first()
         
         if not car:
             raise HTTPException(404, "Автомобиль не найден")
         
-        return {
-            "id": car.id,
-            "stamp": car.stamp_id.stamp,
-            "model": car.model_car_id.model_car,
-            "run_km": car.run_km,
-            "vin": car.vin,
-            "status": car.status_id.status,
-            "price": car.price,
-            "description": car.description
-        }
+        return car
     except HTTPException as http_exc:
         raise http_exc
 
 
 @app.delete("/admin/cars/{car_id}", tags=["Admin"])
-async def delete_car(car_id: int, token: str = Header(...)):
+def delete_car(car_id: int, token: str = Header(...)):
     """Удаление автомобиля"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -927,43 +1418,63 @@ async def delete_car(car_id: int, token: str = Header(...)):
         if sales_records:
             raise HTTPException(400, "Невозможно удалить автомобиль, так как есть связанные продажи")
         
-        car.delete_instance()
+        with database_connection.atomic():
+            car.delete_instance()
+            inventory.record_car_changes([car_id], inventory.DELETED)
+        collection_versions.bump(CARS)
+        inventory.publish_car_changes([car_id], inventory.DELETED)
         return {"message": "Автомобиль успешно удален"}
     except HTTPException as http_exc:
         raise http_exc
 
 
+def shopping_query():
+    """Записи о покупках с автомобилем и покупателем одной выборкой"""
+    return (Shopping
+            .select(Shopping.id, Shopping.date_buy, Shopping.price,
+                    Cars.id.alias('car_id'), Cars.vin, Stamp.stamp, ModelCar.model_car,
+                    Users.id.alias('buyer_id'), Users.full_name, Users.email)
+            .join(Cars, on=(Shopping.car_id == Cars.id))
+            .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+            .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
+            .join(Users, on=(Shopping.buyer_id == Users.id))
+            .dicts())
+
+
+def shopping_item(shop: dict) -> dict:
+    return {
+        "id": shop["id"],
+        "car": {
+            "id": shop["car_id"],
+            "stamp": shop["stamp"],
+            "model": shop["model_car"],
+            "vin": shop["vin"]
+        },
+        "buyer": {
+            "id": shop["buyer_id"],
+            "name": shop["full_name"],
+            "email": shop["email"]
+        },
+        "date_buy": shop["date_buy"],
+        "price": shop["price"]
+    }
+
+
 @app.get("/admin/shopping/", tags=["Admin"])
-async def get_all_shopping(token: str = Header(...)):
-    """Получение всех записей о покупках"""
+def get_all_shopping(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                     stream: bool = False, token: str = Header(...)):
+    """Получение всех записей о покупках (постранично или целиком потоком при stream=true)"""
     current_user = get_user_by_token(token, "Администратор")
     try:
-        shopping = (Shopping
-                    .select(Shopping, Cars, Users)
-                    .join(Cars)
-                    .join(Users, on=(Shopping.buyer_id == Users.id)))
-        
-        return [{
-            "id": shop.id,
-            "car": {
-                "id": shop.car_id.id,
-                "stamp": shop.car_id.stamp_id.stamp,
-                "model": shop.car_id.model_car_id.model_car,
-                "vin": shop.car_id.vin
-            },
-            "buyer": {
-                "id": shop.buyer_id.id,
-                "name": shop.buyer_id.full_name,
-                "email": shop.buyer_id.email
-            },
-            "date_buy": shop.date_buy.isoformat(),
-            "price": shop.price
-        } for shop in shopping]
+        if stream:
+            return stream_response(shopping_query().order_by(Shopping.id), shopping_item)
+        shopping, next_cursor = paginate(shopping_query(), [Shopping.id], cursor, limit)
+        return page_response([shopping_item(shop) for shop in shopping], next_cursor)
     except HTTPException as http_exc:
         raise http_exc
 
 @app.post("/admin/shopping/", tags=["Admin"])
-async def create_shopping(shopping_data: ShoppingCreate, token: str = Header(...)):
+def create_shopping(shopping_data: ShoppingCreate, token: str = Header(...)):
     """Создание записи о покупке"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -986,7 +1497,7 @@ async def create_shopping(shopping_data: ShoppingCreate, token: str = Header(...
         raise http_exc
 
 @app.delete("/admin/shopping/{shopping_id}", tags=["Admin"])
-async def delete_shopping(shopping_id: int, token: str = Header(...)):
+def delete_shopping(shopping_id: int, token: str = Header(...)):
     """Удаление записи о покупке"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -1000,37 +1511,53 @@ async def delete_shopping(shopping_id: int, token: str = Header(...)):
         raise http_exc
 
 
+def sales_query():
+    """Записи о продажах с автомобилем и покупателем одной выборкой"""
+    return (Sales
+            .select(Sales.id, Sales.date_sale, Sales.price,
+                    Cars.id.alias('car_id'), Cars.vin, Stamp.stamp, ModelCar.model_car,
+                    Users.id.alias('buyer_id'), Users.full_name, Users.email)
+            .join(Cars, on=(Sales.car_id == Cars.id))
+            .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+            .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
+            .join(Users, on=(Sales.buyer_id == Users.id))
+            .dicts())
+
+
+def sales_item(sale: dict) -> dict:
+    return {
+        "id": sale["id"],
+        "car": {
+            "id": sale["car_id"],
+            "stamp": sale["stamp"],
+            "model": sale["model_car"],
+            "vin": sale["vin"]
+        },
+        "buyer": {
+            "id": sale["buyer_id"],
+            "name": sale["full_name"],
+            "email": sale["email"]
+        },
+        "date_sale": sale["date_sale"],
+        "price": sale["price"]
+    }
+
+
 @app.get("/admin/sales/", tags=["Admin"])
-async def get_all_sales(token: str = Header(...)):
-    """Получение всех записей о продажах"""
+def get_all_sales(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                  stream: bool = False, token: str = Header(...)):
+    """Получение всех записей о продажах (постранично или целиком потоком при stream=true)"""
     current_user = get_user_by_token(token, "Администратор")
     try:
-        sales = (Sales
-                 .select(Sales, Cars, Users)
-                 .join(Cars)
-                 .join(Users, on=(Sales.buyer_id == Users.id)))
-        
-        return [{
-            "id": sale.id,
-            "car": {
-                "id": sale.car_id.id,
-                "stamp": sale.car_id.stamp_id.stamp,
-                "model": sale.car_id.model_car_id.model_car,
-                "vin": sale.car_id.vin
-            },
-            "buyer": {
-                "id": sale.buyer_id.id,
-                "name": sale.buyer_id.full_name,
-                "email": sale.buyer_id.email
-            },
-            "date_sale": sale.date_sale.isoformat(),
-            "price": sale.price
-        } for sale in sales]
+        if stream:
+            return stream_response(sales_query().order_by(Sales.id), sales_item)
+        sales, next_cursor = paginate(sales_query(), [Sales.id], cursor, limit)
+        return page_response([sales_item(sale) for sale in sales], next_cursor)
     except HTTPException as http_exc:
         raise http_exc
 
 @app.post("/admin/sales/", tags=["Admin"])
-async def create_sale(sale_data: SalesCreate, token: str = Header(...)):
+def create_sale(sale_data: SalesCreate, token: str = Header(...)):
     """Создание записи о продаже"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -1054,7 +1581,7 @@ async def create_sale(sale_data: SalesCreate, token: str = Header(...)):
 
 
 @app.delete("/admin/sales/{sale_id}", tags=["Admin"])
-async def delete_sale(sale_id: int, token: str = Header(...)):
+def delete_sale(sale_id: int, token: str = Header(...)):
     """Удаление записи о продаже"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -1069,7 +1596,7 @@ async def delete_sale(sale_id: int, token: str = Header(...)):
 
 
 @app.post("/admin/users/", tags=["Admin"])
-async def create_user(user: Registration, token: str = Header(...)):
+def create_user(user: Registration, token: str = Header(...)):
     """Создание нового пользователя администратором"""
     current_user = get_user_by_token(token, "Администратор")
     if not re.fullmatch(EMAIL_REGEX, user.email) or not re.fullmatch(PHONE_REGEX, user.phone):
@@ -1080,9 +1607,9 @@ async def create_user(user: Registration, token: str = Header(...)):
         if existing_user:
             raise HTTPException(403, 'Пользователь с таким email/номером телефона уже существует.')
 
-        hashed_password = ph.hash(user.password)
+        hashed_password = hash_password(user.password)
         with database_connection.atomic():
-            user_role = Roles.get(Roles.name=='Пользователь')
+            user_role_id = roles.get_id('Пользователь')
             new_user = Users.create(
                 email=email,
                 phone=user.phone,
@@ -1091,7 +1618,7 @@ async def create_user(user: Registration, token: str = Header(...)):
             )
             UserRoles.create(
                 user_id=new_user.id,
-                role_id=user_role.id)
+                role_id=user_role_id)
 
         return {'message': 'Пользователь успешно создан!', 'user_id': new_user.id}
     except HTTPException as http_exc:
@@ -1099,7 +1626,7 @@ async def create_user(user: Registration, token: str = Header(...)):
 
 
 @app.put("/admin/users/{user_id}", tags=["Admin"])
-async def update_user(user_id: int, user_data: UserUpdate, token: str = Header(...)):
+def update_user(user_id: int, user_data: UserUpdate, token: str = Header(...)):
     """Обновление профиля пользователя администратором"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -1127,7 +1654,7 @@ async def update_user(user_id: int, user_data: UserUpdate, token: str = Header(.
 
 
 @app.get("/admin/users/{user_id}", tags=["Admin"])
-async def get_user(user_id: int, token: str = Header(...)):
+def get_user(user_id: int, token: str = Header(...)):
     """Получение информации о пользователе по ID"""
     current_user = get_user_by_token(token, "Администратор")
     try:
@@ -1153,13 +1680,82 @@ async def get_user(user_id: int, token: str = Header(...)):
         raise http_exc
 
 
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv; charset=utf-8"),
+    "ndjson": (stream_ndjson, "application/x-ndjson"),
+}
+
+
+def export_query(collection: str, filters: CarFilters, current_user: Users):
+    """Запрос выгрузки коллекции с теми же фильтрами, что у списка"""
+    if collection == "cars":
+        order_fields, descending = car_ordering(filters.sort)
+        query = filter_cars(all_cars_query(), filters)
+        return query.order_by(*[field.desc() if descending else field for field in order_fields])
+    if collection == "sales":
+        return sales_query().order_by(Sales.id)
+    if collection == "shopping":
+        return shopping_query().order_by(Shopping.id)
+    if collection == "users":
+        return (Users
+                .select(Users.id, Users.full_name.alias('name'), Users.email, Users.phone)
+                .where(Users.id != current_user.id)
+                .order_by(Users.id)
+                .dicts())
+    raise HTTPException(404, "Неизвестная коллекция. Допустимые значения: cars, sales, shopping, users")
+
+
+@app.get("/admin/export/{collection}", tags=["Admin"])
+def export_collection(collection: str, format: str = "csv", gzip: bool = False,
+                      filters: CarFilters = Depends(), token: str = Header(...)):
+    """Выгрузка автомобилей, продаж, покупок или пользователей в CSV/NDJSON потоком.
+
+    Строки читаются серверным курсором и сразу отдаются клиенту (при gzip=true -
+    сжатыми), поэтому память не зависит от объема выгрузки. Для cars
+    действуют фильтры и сортировка каталога.
+    """
+    current_user = get_user_by_token(token, "Администратор")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, f'Неизвестный формат. Допустимые значения: {", ".join(EXPORT_FORMATS)}')
+    encode, media_type = EXPORT_FORMATS[format]
+
+    chunks = encode(iter_query_rows(export_query(collection, filters, current_user)))
+    filename = f"{collection}.{format}"
+    if gzip:
+        chunks = gzip_stream(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/admin/stats/", tags=["Admin"])
+def get_stats(token: str = Header(...)):
+    """Служебная статистика сервера (пул соединений с БД)"""
+    get_user_by_token(token, "Администратор")
+    return {
+        "db_pool": get_pool_stats(),
+        "auth_mode": AUTH_MODE,
+        "session_cache": session_cache.stats(),
+        "token_denylist": len(signed_tokens.denylist),
+        "lookup_cache": get_lookup_stats(),
+        "events": broker.stats(),
+        "vin_filter": vins.vin_filter.stats(),
+    }
+
+
 @app.post('/users/logout/', tags=['Users'])
-async def logout_user(token: str = Header(...)):
+def logout_user(token: str = Header(...)):
     """Выход пользователя из системы"""
     try:
-        user_token = UserToken.select().where(UserToken.token == token).first()
-        if user_token:
-            user_token.delete_instance()
+        if AUTH_MODE == "signed":
+            claims = signed_tokens.read_token(token)
+            if claims:
+                signed_tokens.denylist.revoke_token(claims)
+            return {'message': 'Вы успешно вышли из системы'}
+        UserToken.delete().where(UserToken.token == token).execute()
+        session_cache.invalidate(token)
+        token_extensions.discard(token)
         return {'message': 'Вы успешно вышли из системы'}
     except HTTPException as http_exc:
         raise http_exc
@@ -0,0 +1,498 @@
+"""Нагрузочные замеры API.
+
+Запуск (API должен быть запущен, база заполнена через test_data.py):
+    python benchmark.py concurrency --token <токен администратора>
+    python benchmark.py login --email limon@gmail.com --password <пароль>
+    python benchmark.py search --token <токен> --seed 1000000
+    python benchmark.py buy --token <токен пользователя> --admin-token <токен администратора>
+    python benchmark.py bulk --token <токен администратора> --rows 100000
+
+Проверка числа SQL-запросов и сравнение способов выборки не требуют
+запущенного API и MySQL:
+    python benchmark.py queries
+    python benchmark.py projections --rows 100000
+"""
+import argparse
+import json
+import random
+import inspect
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+API_BASE_URL = "http://localhost:8000"
+
+
+def percentile(values, percent):
+    """Перцентиль по отсортированной выборке"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def timed_get(session, path, headers):
+    """Выполнить GET-запрос и вернуть время ответа в миллисекундах"""
+    started = time.perf_counter()
+    response = session.get(f"{API_BASE_URL}{path}", headers=headers)
+    response.raise_for_status()
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_concurrency(token, slow_path, levels, samples):
+    """p50/p99 для /users/cars/available при параллельных медленных запросах.
+
+    На каждом уровне запускается N фоновых клиентов, которые непрерывно
+    выполняют медленный запрос, и измеряется задержка каталога. При работе
+    ORM в event loop p99 растет линейно с N, в пуле потоков - нет.
+    """
+    headers = {"token": token}
+    print(f"{'медленных':>10} {'p50, мс':>10} {'p99, мс':>10}")
+    for level in levels:
+        stop = threading.Event()
+
+        def slow_client():
+            with requests.Session() as session:
+                while not stop.is_set():
+                    timed_get(session, slow_path, headers)
+
+        with ThreadPoolExecutor(max_workers=level or 1) as pool:
+            for _ in range(level):
+                pool.submit(slow_client)
+            with requests.Session() as session:
+                latencies = [timed_get(session, "/users/cars/available", headers)
+                             for _ in range(samples)]
+            stop.set()
+
+        print(f"{level:>10} {statistics.median(latencies):>10.1f} "
+              f"{percentile(latencies, 99):>10.1f}")
+
+
+def bench_login(email, password, clients, duration):
+    """Пропускная способность /users/auth/ при одновременных входах.
+
+    Пока идут входы, отдельный клиент опрашивает /docs: если хеширование
+    блокирует event loop, его задержка растет вместе с числом входов.
+    """
+    stop = threading.Event()
+    login_latencies = []
+    probe_latencies = []
+    lock = threading.Lock()
+
+    def login_client():
+        with requests.Session() as session:
+            while not stop.is_set():
+                started = time.perf_counter()
+                response = session.post(f"{API_BASE_URL}/users/auth/",
+                                        json={"email": email, "password": password})
+                response.raise_for_status()
+                with lock:
+                    login_latencies.append((time.perf_counter() - started) * 1000)
+
+    def probe_client():
+        with requests.Session() as session:
+            while not stop.is_set():
+                probe_latencies.append(timed_get(session, "/docs", {}))
+                time.sleep(0.05)
+
+    with ThreadPoolExecutor(max_workers=clients + 1) as pool:
+        for _ in range(clients):
+            pool.submit(login_client)
+        pool.submit(probe_client)
+        time.sleep(duration)
+        stop.set()
+
+    print(f"клиентов: {clients}, длительность: {duration} с")
+    print(f"входов в секунду: {len(login_latencies) / duration:.1f}")
+    print(f"вход p50/p99, мс: {statistics.median(login_latencies):.1f} / "
+          f"{percentile(login_latencies, 99):.1f}")
+    print(f"/docs во время входов p50/p99, мс: {statistics.median(probe_latencies):.1f} / "
+          f"{percentile(probe_latencies, 99):.1f}")
+
+
+def bench_buy(token, admin_token, buyers, rounds):
+    """Одновременная покупка одного автомобиля: ровно один успех и задержка ответов.
+
+    В каждом раунде администратор добавляет новый автомобиль, затем buyers
+    потоков одновременно (через барьер) вызывают /users/cars/buy.
+    """
+    failed = False
+    print(f"{'раунд':>6} {'успехов':>8} {'отказов':>8} {'покупок':>8} {'p50, мс':>9} {'p99, мс':>9}")
+    for round_number in range(rounds):
+        vin = f"STRESS{time.time_ns()}"
+        response = requests.post(f"{API_BASE_URL}/admin/cars/", headers={"token": admin_token}, json={
+            "stamp": "Toyota", "model_car": "Camry", "run": 0, "price": 1000000, "vin": vin})
+        response.raise_for_status()
+        car_id = response.json()["car_id"]
+
+        barrier = threading.Barrier(buyers)
+        results = []
+        lock = threading.Lock()
+
+        def buyer():
+            with requests.Session() as session:
+                barrier.wait()
+                started = time.perf_counter()
+                response = session.post(f"{API_BASE_URL}/users/cars/buy",
+                                        headers={"token": token}, params={"car_id": car_id})
+                with lock:
+                    results.append((response.status_code, (time.perf_counter() - started) * 1000))
+
+        with ThreadPoolExecutor(max_workers=buyers) as pool:
+            for _ in range(buyers):
+                pool.submit(buyer)
+
+        response = requests.get(f"{API_BASE_URL}/admin/shopping/", headers={"token": admin_token},
+                                params={"stream": "true"})
+        response.raise_for_status()
+        purchases = sum(1 for row in response.json() if row["car"]["id"] == car_id)
+        wins = sum(1 for status, _ in results if status == 200)
+        rejected = sum(1 for status, _ in results if status == 400)
+        latencies = [latency for _, latency in results]
+        failed |= wins != 1 or purchases != 1 or wins + rejected != buyers
+        print(f"{round_number + 1:>6} {wins:>8} {rejected:>8} {purchases:>8} "
+              f"{statistics.median(latencies):>9.1f} {percentile(latencies, 99):>9.1f}")
+    if failed:
+        print("нарушено условие: ровно одна успешная покупка на автомобиль")
+        sys.exit(1)
+
+
+def bulk_file(rows, data_format):
+    """Файл импорта из rows автомобилей с уникальными VIN, порциями байтов"""
+    prefix = f"BULK{time.time_ns()}"
+    if data_format == "csv":
+        yield b"stamp,model_car,run,price,vin,description\n"
+    lines = []
+    for i in range(rows):
+        car = {"stamp": SEARCH_STAMPS[i % len(SEARCH_STAMPS)], "model_car": SEARCH_MODELS[i % len(SEARCH_MODELS)],
+               "run": i, "price": 100000 + i, "vin": f"{prefix}{i:08d}", "description": "импорт"}
+        if data_format == "csv":
+            lines.append(",".join(str(car[field]) for field in
+                                  ("stamp", "model_car", "run", "price", "vin", "description")))
+        else:
+            lines.append(json.dumps(car, ensure_ascii=False))
+        if len(lines) == 1000:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def bench_bulk(token, rows, data_format, target_rps):
+    """Скорость /admin/cars/bulk на файле из rows строк; код 1, если ниже target_rps"""
+    started = time.perf_counter()
+    response = requests.post(f"{API_BASE_URL}/admin/cars/bulk", headers={"token": token},
+                             params={"format": data_format}, data=bulk_file(rows, data_format))
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    report = response.json()
+    rps = report["imported"] / elapsed
+    print(f"формат: {data_format}, строк: {rows}, импортировано: {report['imported']}, "
+          f"ошибок: {report['failed']}")
+    print(f"время: {elapsed:.1f} с, строк в секунду: {rps:.0f} (цель {target_rps:.0f})")
+    if report["failed"] or rps < target_rps:
+        sys.exit(1)
+
+
+SEARCH_STAMPS = ["Toyota", "Honda", "BMW", "Mercedes-Benz", "Audi", "Ford", "Lada", "Kia", "Hyundai", "Nissan"]
+SEARCH_MODELS = ["Camry", "Civic", "X5", "E-Class", "A6", "Focus", "Vesta", "Rio", "Solaris", "Qashqai"]
+SEARCH_WORDS = ["один", "владелец", "гаражное", "хранение", "полная", "комплектация", "кожаный",
+                "салон", "после", "ремонта", "зимняя", "резина", "сервисная", "книжка"]
+SEARCH_QUERIES = ["Toyota", "toy", "BMW X5", "Mercedes E-Class", "гаражное хранение",
+                  "кожаный салон Audi", "BENCH0000001", "Lada Vesta один владелец"]
+
+
+def seed_search_cars(count):
+    """Добавить в MySQL count автомобилей со случайными описаниями и заполнить поисковый индекс"""
+    from database import database_connection
+    from lookups import stamps, car_models, statuses
+    from models import Cars, CarSearch, CarCatalog
+
+    with database_connection.connection_context():
+        for table in (stamps, car_models, statuses):
+            table.load()
+        stamp_ids = [stamps.get_or_create_id(name)[0] for name in SEARCH_STAMPS]
+        model_ids = [car_models.get_or_create_id(name)[0] for name in SEARCH_MODELS]
+        available_id = statuses.get_id("Доступен")
+        start = Cars.select().count()
+        rows = ({
+            "stamp_id": random.choice(stamp_ids), "model_car_id": random.choice(model_ids),
+            "run_km": random.randint(0, 300000), "vin": f"BENCH{start + i:012d}",
+            "status_id": available_id, "price": random.randint(100000, 10000000),
+            "description": " ".join(random.sample(SEARCH_WORDS, 4)),
+        } for i in range(count))
+        insert_chunked(Cars, rows, size=1000)
+        CarSearch.refresh()
+        CarCatalog.refresh()
+    print(f"добавлено автомобилей: {count}")
+
+
+def bench_search(token, queries, samples, target_p99):
+    """p50/p99 поиска /users/cars/search по набору запросов; код 1, если p99 выше цели"""
+    headers = {"token": token}
+    failed = False
+    print(f"{'запрос':>28} {'найдено':>8} {'p50, мс':>9} {'p99, мс':>9}")
+    with requests.Session() as session:
+        for query in queries:
+            latencies = []
+            found = 0
+            for _ in range(samples):
+                started = time.perf_counter()
+                response = session.get(f"{API_BASE_URL}/users/cars/search",
+                                       headers=headers, params={"q": query, "limit": 20})
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+                found = len(response.json()["items"])
+            p99 = percentile(latencies, 99)
+            failed |= p99 > target_p99
+            mark = "" if p99 <= target_p99 else "  ВЫШЕ ЦЕЛИ"
+            print(f"{query:>28} {found:>8} {statistics.median(latencies):>9.1f} {p99:>9.1f}{mark}")
+    if failed:
+        sys.exit(1)
+
+
+# Верхняя граница числа SQL-запросов на один вызов обработчика
+# (проверка токена + выборка страницы). Не должна зависеть от числа строк.
+QUERY_BUDGETS = {
+    "get_all_shopping": 2,
+    "get_all_sales": 2,
+    "get_all_cars": 2,
+    "get_available_cars": 2,
+    "get_all_anketi": 2,
+    "get_list_users": 2,
+    "get_my_purchases": 2,
+    "get_all_stamps": 2,
+    "get_all_models": 2,
+}
+
+
+def insert_chunked(model, rows, size=100):
+    """insert_many порциями: у SQLite ограничено число параметров в запросе"""
+    from peewee import chunked
+
+    for chunk in chunked(rows, size):
+        model.insert_many(chunk).execute()
+
+
+def seed_ledgers(rows):
+    """Заполнить пустую базу rows автомобилями, анкетами, покупками и продажами; вернуть токен администратора"""
+    from models import (Roles, Users, UserRoles, UserToken, Status, Stamp, ModelCar, Cars,
+                        CarCatalog, Shopping, Sales, Anketa)
+
+    admin_role = Roles.create(name="Администратор")
+    available = Status.create(status="Доступен")
+    sold = Status.create(status="Продан")
+    stamp = Stamp.create(stamp="Toyota")
+    model = ModelCar.create(model_car="Camry")
+    admin = Users.create(email="admin@example.com", phone="+70000000000",
+                         full_name="Admin", password="-")
+    UserRoles.create(user_id=admin.id, role_id=admin_role.id)
+    token = f"benchmark-{rows}"
+    UserToken.create(user_id=admin.id, token=token,
+                     expires_at=datetime.now() + timedelta(hours=1))
+
+    insert_chunked(Cars, [{
+        "stamp_id": stamp.id, "model_car_id": model.id, "run_km": 1000 + i,
+        "vin": f"VIN{i:014d}", "status_id": sold.id if i % 2 else available.id,
+        "price": 100000 + i, "description": None,
+    } for i in range(rows)])
+    CarCatalog.refresh()
+    car_ids = [car_id for car_id, in Cars.select(Cars.id).tuples()]
+    for ledger in (Shopping, Sales):
+        insert_chunked(ledger, [{
+            "car_id": car_id, "buyer_id": admin.id, "price": 100000,
+        } for car_id in car_ids])
+    insert_chunked(Anketa, [{
+        "user_id": admin.id, "stamp": "Toyota", "model_car": "Camry", "run": i,
+        "price": 100000 + i, "vin": f"ANK{i:014d}",
+    } for i in range(rows)])
+    return token
+
+
+def sqlite_database():
+    """Пустая база SQLite в памяти со счетчиком запросов"""
+    from peewee import SqliteDatabase
+
+    from database import QueryCountingMixin
+
+    class CountingSqliteDatabase(QueryCountingMixin, SqliteDatabase):
+        pass
+
+    return CountingSqliteDatabase(":memory:")
+
+
+def call_handler(handler, token):
+    """Вызвать обработчик напрямую, подставив значения по умолчанию для Depends(), Header() и Response"""
+    from fastapi import Response, params
+
+    kwargs = {"token": token}
+    for parameter in inspect.signature(handler).parameters.values():
+        if parameter.name in kwargs:
+            continue
+        if isinstance(parameter.default, params.Depends):
+            kwargs[parameter.name] = parameter.annotation()
+        elif isinstance(parameter.default, params.Param):
+            kwargs[parameter.name] = parameter.default.default
+        elif parameter.annotation is Response:
+            kwargs[parameter.name] = Response()
+    return handler(**kwargs)
+
+
+def check_query_counts(row_counts):
+    """Вызвать обработчики списков на базах разного размера и проверить QUERY_BUDGETS"""
+    import api
+    from database import count_queries
+    from lookups import lookup_tables
+    from models import tables
+
+    failed = False
+    print(f"{'обработчик':>20} {'строк':>8} {'запросов':>9} {'лимит':>6}")
+    for rows in row_counts:
+        db = sqlite_database()
+        with db.bind_ctx(tables):
+            db.create_tables(tables)
+            token = seed_ledgers(rows)
+            for table in lookup_tables.values():
+                table.load()
+            for name, budget in QUERY_BUDGETS.items():
+                with count_queries() as stats:
+                    call_handler(getattr(api, name), token)
+                failed |= stats.count > budget
+                mark = "" if stats.count <= budget else "  ПРЕВЫШЕН"
+                print(f"{name:>20} {rows:>8} {stats.count:>9} {budget:>6}{mark}")
+    if failed:
+        sys.exit(1)
+
+
+def measure(func):
+    """Время выполнения (с) и пик выделенной памяти (МиБ) отдельными прогонами"""
+    started = time.perf_counter()
+    rows = len(func())
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak / 2 ** 20
+
+
+def bench_projections(rows):
+    """Выборка всех автомобилей: экземпляры моделей с join, проекция с join и витрина каталога"""
+    import api
+    from models import tables, Cars, Stamp, ModelCar, Status
+
+    def model_instances():
+        query = (Cars
+                 .select(Cars, Stamp, ModelCar, Status)
+                 .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+                 .switch(Cars)
+                 .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
+                 .switch(Cars)
+                 .join(Status, on=(Cars.status_id == Status.id)))
+        return [{
+            "id": car.id,
+            "stamp": car.stamp_id.stamp,
+            "model": car.model_car_id.model_car,
+            "run_km": car.run_km,
+            "vin": car.vin,
+            "status": car.status_id.status,
+            "price": car.price,
+            "description": car.description
+        } for car in query]
+
+    def joined_projection():
+        return list(Cars
+                    .select(Cars.id, Stamp.stamp, ModelCar.model_car.alias('model'), Cars.run_km,
+                            Cars.vin, Status.status, Cars.price, Cars.description)
+                    .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+                    .switch(Cars)
+                    .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
+                    .switch(Cars)
+                    .join(Status, on=(Cars.status_id == Status.id))
+                    .dicts())
+
+    def catalog():
+        return list(api.all_cars_query())
+
+    db = sqlite_database()
+    with db.bind_ctx(tables):
+        db.create_tables(tables)
+        seed_ledgers(rows)
+        print(f"{'способ':>16} {'строк':>8} {'строк/с':>10} {'пик, МиБ':>9}")
+        for name, func in (("модели", model_instances), ("проекция", joined_projection),
+                           ("витрина", catalog)):
+            count, elapsed, peak = measure(func)
+            print(f"{name:>16} {count:>8} {count / elapsed:>10.0f} {peak:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="задержка каталога под нагрузкой")
+    concurrency.add_argument("--token", required=True)
+    concurrency.add_argument("--slow-path", default="/admin/cars/")
+    concurrency.add_argument("--levels", default="0,1,2,4,8,16")
+    concurrency.add_argument("--samples", type=int, default=200)
+
+    login = subparsers.add_parser("login", help="пропускная способность входа")
+    login.add_argument("--email", required=True)
+    login.add_argument("--password", required=True)
+    login.add_argument("--clients", type=int, default=16)
+    login.add_argument("--duration", type=float, default=10.0)
+
+    queries = subparsers.add_parser("queries", help="число SQL-запросов обработчиков списков")
+    queries.add_argument("--rows", default="10,1000")
+
+    buy = subparsers.add_parser("buy", help="одновременные покупки одного автомобиля")
+    buy.add_argument("--token", required=True)
+    buy.add_argument("--admin-token", required=True)
+    buy.add_argument("--buyers", type=int, default=200)
+    buy.add_argument("--rounds", type=int, default=5)
+
+    bulk = subparsers.add_parser("bulk", help="скорость пакетного импорта автомобилей")
+    bulk.add_argument("--token", required=True)
+    bulk.add_argument("--rows", type=int, default=100000)
+    bulk.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    bulk.add_argument("--target-rps", type=float, default=5000.0)
+
+    search = subparsers.add_parser("search", help="задержка полнотекстового поиска")
+    search.add_argument("--token", required=True)
+    search.add_argument("--seed", type=int, default=0,
+                        help="сначала добавить столько автомобилей в MySQL")
+    search.add_argument("--samples", type=int, default=50)
+    search.add_argument("--target-p99", type=float, default=50.0)
+
+    projections = subparsers.add_parser("projections", help="модели против проекций на больших выборках")
+    projections.add_argument("--rows", type=int, default=100000)
+
+    args = parser.parse_args()
+    if args.command == "concurrency":
+        levels = [int(level) for level in args.levels.split(",")]
+        bench_concurrency(args.token, args.slow_path, levels, args.samples)
+    elif args.command == "login":
+        bench_login(args.email, args.password, args.clients, args.duration)
+    elif args.command == "queries":
+        check_query_counts([int(rows) for rows in args.rows.split(",")])
+    elif args.command == "buy":
+        bench_buy(args.token, args.admin_token, args.buyers, args.rounds)
+    elif args.command == "bulk":
+        bench_bulk(args.token, args.rows, args.format, args.target_rps)
+    elif args.command == "search":
+        if args.seed:
+            seed_search_cars(args.seed)
+        bench_search(args.token, SEARCH_QUERIES, args.samples, args.target_p99)
+    elif args.command == "projections":
+        bench_projections(args.rows)
+
+
+if __name__ == "__main__":
+    main()
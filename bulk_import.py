@@ -0,0 +1,245 @@
+"""Пакетный импорт автомобилей из CSV или NDJSON.
+
+Тело запроса читается потоком в event loop и построчно передается через
+ограниченный канал anyio в поток пула, где строки разбираются и вставляются
+порциями по BULK_IMPORT_CHUNK_SIZE: одна транзакция и один insert_many
+на порцию. Марки и модели берутся из кэша справочников, VIN проверяются
+одним запросом к реестру на порцию. Ошибочные строки не прерывают импорт,
+а попадают в отчет с номером строки. Если клиент оборвал загрузку,
+недописанная порция не вставляется.
+"""
+import csv
+import json
+import threading
+from typing import Iterable, Iterator, Optional
+
+import anyio
+from anyio import from_thread
+from peewee import IntegrityError, DataError
+
+from config import BULK_IMPORT_CHUNK_SIZE, BULK_IMPORT_MAX_ERRORS
+from database import database_connection
+from lookups import statuses, resolve_car_dimensions
+from models import Cars, VinRegistry, Stamp, ModelCar
+from versions import collection_versions, CARS
+import inventory
+import vins
+
+
+FORMATS = ("csv", "ndjson")
+REQUIRED_FIELDS = ("stamp", "model_car", "run", "price", "vin")
+# Наибольшая длина строковых полей - по ширине столбцов в БД
+MAX_LENGTHS = {
+    "stamp": Stamp.stamp.max_length,
+    "model_car": ModelCar.model_car.max_length,
+    "vin": Cars.vin.max_length,
+    "description": Cars.description.max_length,
+}
+# Диапазон столбцов INT в MySQL
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+class ImportAborted(Exception):
+    """Загрузка файла прервана, импорт остановлен без вставки последней порции"""
+
+
+class LineStream:
+    """Канал порций строк из event loop (запись) в поток импорта (чтение).
+
+    send - ограниченный поток anyio: запись ждет, пока поток импорта не
+    освободит место. Поток импорта должен быть запущен через пул anyio.
+    """
+
+    def __init__(self, max_batches: int = 16):
+        self.send, self._receive = anyio.create_memory_object_stream(max_batches)
+        self._aborted = threading.Event()
+
+    def finish(self):
+        """Данные закончились: импорт вставит последнюю порцию и вернет отчет"""
+        self.send.close()
+
+    def abort(self):
+        """Загрузка оборвана: импорт остановится с ImportAborted"""
+        self._aborted.set()
+        self.send.close()
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            while True:
+                try:
+                    lines = from_thread.run(self._receive.receive)
+                except anyio.EndOfStream:
+                    if self._aborted.is_set():
+                        raise ImportAborted()
+                    return
+                yield from lines
+        finally:
+            # Отправитель получит BrokenResourceError, если импорт завершился раньше
+            from_thread.run_sync(self._receive.close)
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_rows(lines: Iterable[str], data_format: str):
+    """Пары (номер строки, словарь полей или RowError)"""
+    if data_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, RowError("Некорректный JSON")
+            continue
+        if not isinstance(row, dict):
+            yield number, RowError("Строка должна быть JSON-объектом")
+            continue
+        yield number, row
+
+
+def validate_row(row: dict) -> dict:
+    """Поля автомобиля из строки файла"""
+    missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, "")]
+    if missing:
+        raise RowError(f"Не заполнены поля: {', '.join(missing)}")
+    try:
+        run = int(row["run"])
+        price = int(row["price"])
+    except (TypeError, ValueError):
+        raise RowError("Пробег и цена должны быть целыми числами")
+    if not (INT_MIN <= run <= INT_MAX and INT_MIN <= price <= INT_MAX):
+        raise RowError("Пробег или цена вне допустимого диапазона")
+    description = row.get("description")
+    car = {
+        "stamp": str(row["stamp"]).strip(),
+        "model_car": str(row["model_car"]).strip(),
+        "run": run,
+        "price": price,
+        "vin": str(row["vin"]).strip(),
+        "description": str(description) if description not in (None, "") else None,
+    }
+    too_long = [field for field, max_length in MAX_LENGTHS.items()
+                if car[field] is not None and len(car[field]) > max_length]
+    if too_long:
+        raise RowError(f"Слишком длинные значения полей: {', '.join(too_long)}")
+    return car
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < BULK_IMPORT_MAX_ERRORS:
+            self.errors.append({"row": number, "error": message})
+
+    def as_dict(self) -> dict:
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+def _car_row(car: dict, available_status_id: int) -> dict:
+    stamp_id, model_car_id = resolve_car_dimensions(car["stamp"], car["model_car"])
+    return {
+        "stamp_id": stamp_id,
+        "model_car_id": model_car_id,
+        "run_km": car["run"],
+        "vin": car["vin"],
+        "status_id": available_status_id,
+        "price": car["price"],
+        "description": car["description"],
+    }
+
+
+def _insert_one(number: int, row: dict, report: ImportReport) -> Optional[int]:
+    try:
+        with database_connection.atomic():
+            car_id = Cars.insert(row).execute()
+            vins.register_vin(row["vin"], car_id=car_id)
+            inventory.record_car_changes([car_id], inventory.ADDED)
+        return car_id
+    except IntegrityError:
+        report.error(number, "Автомобиль с таким VIN уже есть в базе")
+        return None
+    except DataError:
+        report.error(number, "Значения строки не помещаются в столбцы БД")
+        return None
+
+
+def insert_chunk(chunk: list, report: ImportReport) -> list:
+    """Вставить порцию [(номер строки, автомобиль)] одной транзакцией; возвращает id новых автомобилей"""
+    taken = {vin for vin, in VinRegistry
+             .select(VinRegistry.vin)
+             .where(VinRegistry.vin.in_([car["vin"] for _, car in chunk]))
+             .tuples()}
+    available_status_id = statuses.get_id("Доступен")
+    rows = []
+    for number, car in chunk:
+        if car["vin"] in taken:
+            report.error(number, "Автомобиль с таким VIN уже есть в базе")
+            continue
+        try:
+            row = _car_row(car, available_status_id)
+        except DataError:
+            report.error(number, "Значения строки не помещаются в столбцы БД")
+            continue
+        taken.add(car["vin"])
+        rows.append((number, row))
+    if not rows:
+        return []
+
+    try:
+        with database_connection.atomic():
+            Cars.insert_many([row for _, row in rows]).execute()
+            car_ids = dict(Cars
+                           .select(Cars.vin, Cars.id)
+                           .where(Cars.vin.in_([row["vin"] for _, row in rows]))
+                           .tuples())
+            VinRegistry.insert_many([{"vin": vin, "car_id": car_id}
+                                     for vin, car_id in car_ids.items()]).execute()
+            inventory.record_car_changes(car_ids.values(), inventory.ADDED)
+        for vin in car_ids:
+            vins.vin_filter.add(vin)
+        inserted = list(car_ids.values())
+    except (IntegrityError, DataError):
+        # VIN заняли параллельно или строка не прошла проверку БД:
+        # вставляем по одной, чтобы найти конфликтные строки
+        inserted = [car_id for car_id in (_insert_one(number, row, report) for number, row in rows)
+                    if car_id is not None]
+    report.imported += len(inserted)
+    return inserted
+
+
+def _committed(car_ids: list):
+    if car_ids:
+        # Новые марки и модели отмечает resolve_car_dimensions при их создании
+        collection_versions.bump(CARS)
+        inventory.publish_car_changes(car_ids, inventory.ADDED)
+
+
+def import_cars(lines: Iterable[str], data_format: str,
+                chunk_size: int = BULK_IMPORT_CHUNK_SIZE) -> dict:
+    """Импортировать автомобили из строк файла; возвращает отчет"""
+    report = ImportReport()
+    chunk = []
+    with database_connection.connection_context():
+        for number, row in parse_rows(lines, data_format):
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                chunk.append((number, validate_row(row)))
+            except RowError as exc:
+                report.error(number, str(exc))
+            if len(chunk) >= chunk_size:
+                _committed(insert_chunk(chunk, report))
+                chunk = []
+        if chunk:
+            _committed(insert_chunk(chunk, report))
+    return report.as_dict()
@@ -0,0 +1,110 @@
+"""Настройки API (можно переопределить переменными окружения)"""
+import os
+import tempfile
+
+
+# Параметры argon2. При их изменении хеш пароля пересчитывается при следующем входе.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 4))
+# Количество процессов для хеширования паролей (по умолчанию - по числу ядер)
+HASHER_PROCESSES = int(os.getenv("HASHER_PROCESSES", os.cpu_count() or 1))
+
+# Кэш сессий: сколько токенов держать в памяти и сколько секунд им доверять
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10000))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 60))
+
+# Время жизни токена. Скользящее продление записывается в БД только после того,
+# как прошло TOKEN_REFRESH_AFTER_MINUTES с прошлого продления, и пачками
+# раз в TOKEN_FLUSH_INTERVAL секунд.
+TOKEN_LIFETIME_MINUTES = int(os.getenv("TOKEN_LIFETIME_MINUTES", 60))
+TOKEN_REFRESH_AFTER_MINUTES = int(os.getenv("TOKEN_REFRESH_AFTER_MINUTES", 15))
+TOKEN_FLUSH_INTERVAL = int(os.getenv("TOKEN_FLUSH_INTERVAL", 30))
+
+# Ограничение числа активных сессий пользователя (0 - без ограничения)
+MAX_SESSIONS_PER_USER = int(os.getenv("MAX_SESSIONS_PER_USER", 0))
+# Очистка просроченных токенов: период в секундах и размер одной порции удаления
+TOKEN_REAPER_INTERVAL = int(os.getenv("TOKEN_REAPER_INTERVAL", 300))
+TOKEN_REAPER_BATCH_SIZE = int(os.getenv("TOKEN_REAPER_BATCH_SIZE", 1000))
+
+# Режим аутентификации: "session" - токены хранятся в таблице UserToken,
+# "signed" - подписанные HMAC токены, которые проверяются без обращения к БД.
+AUTH_MODE = os.getenv("AUTH_MODE", "session")
+# Ключ подписи токенов. Должен быть одинаковым у всех процессов API.
+AUTH_SECRET = os.getenv("AUTH_SECRET", "")
+
+# Каталог состояния по умолчанию - свой у каждого пользователя во временном
+# каталоге сервера. Каталоги создаются с правами 0o700, чужой каталог не
+# принимается (см. shared_dirs.py).
+STATE_DIR = os.getenv("STATE_DIR", os.path.join(
+    tempfile.gettempdir(), f"mdk_api-{os.getuid()}" if hasattr(os, "getuid") else "mdk_api"))
+
+# Общий для всех процессов API каталог журнала отзыва токенов (выход, удаление
+# пользователя). По умолчанию - в STATE_DIR, общем для процессов одного
+# сервера; при нескольких серверах нужен общий сетевой каталог.
+# Пустое значение - отзыв действует только в обработавшем его процессе.
+REVOCATIONS_DIR = os.getenv("REVOCATIONS_DIR", os.path.join(STATE_DIR, "revocations"))
+
+# Кэш справочников (статусы, роли, марки, модели): через сколько секунд
+# перечитывать таблицу, чтобы увидеть изменения из других процессов
+LOOKUP_CACHE_TTL = int(os.getenv("LOOKUP_CACHE_TTL", 300))
+
+# Постраничная выдача списков: размер страницы по умолчанию и максимальный
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 500))
+
+# Журналирование запросов API, выполнивших слишком много SQL-запросов
+# или слишком долго работавших с БД (0 - не журналировать)
+SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", 20))
+SLOW_REQUEST_DB_MS = int(os.getenv("SLOW_REQUEST_DB_MS", 200))
+
+# Метрики Prometheus. Если задан METRICS_DIR, каждый процесс API периодически
+# сохраняет туда свои счетчики, а /metrics суммирует данные всех процессов.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = int(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+# Потоковая выдача больших списков: строк в одной порции и порций в буфере
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 1000))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 4))
+# Одновременных потоковых выдач (каждая держит соединение из пула), остальным - 503
+STREAM_MAX_CONCURRENT = int(os.getenv("STREAM_MAX_CONCURRENT", 4))
+
+# Размер пула потоков, в котором выполняются синхронные обработчики. Каждому
+# потоку достается свое соединение, и еще по одному держат потоки потоковой
+# выдачи, поэтому по умолчанию - пул соединений за вычетом STREAM_MAX_CONCURRENT.
+API_THREADPOOL_SIZE = int(os.getenv(
+    "API_THREADPOOL_SIZE",
+    max(1, int(os.getenv("DB_MAX_CONNECTIONS", 20)) - STREAM_MAX_CONCURRENT),
+))
+
+# Полностью пересобрать витрину каталога car_catalog при запуске ("1").
+# Нужно после изменения таблицы Cars в обход API (inventory.record_car_changes).
+CAR_CATALOG_REBUILD = os.getenv("CAR_CATALOG_REBUILD", "") == "1"
+
+# Версии коллекций для ETag хранятся в общем для всех процессов API каталоге
+# VERSIONS_DIR. По умолчанию - в STATE_DIR, общем для процессов одного
+# сервера; при нескольких серверах нужен общий сетевой каталог.
+# Пустое значение - версии в памяти процесса, только для запуска в один процесс:
+# иначе процесс, не обработавший изменение, продолжит отвечать 304.
+VERSIONS_DIR = os.getenv("VERSIONS_DIR", os.path.join(STATE_DIR, "versions"))
+
+# Журнал изменений автомобилей: курсор не продвигается за записи моложе
+# стольких секунд - транзакция с меньшим id может еще не зафиксироваться
+CAR_CHANGES_SETTLE_SECONDS = int(os.getenv("CAR_CHANGES_SETTLE_SECONDS", 5))
+
+# Push-уведомления (SSE): размер очереди одного подписчика и интервал
+# пустых сообщений, которые не дают прокси закрыть соединение
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 100))
+EVENT_KEEPALIVE_INTERVAL = int(os.getenv("EVENT_KEEPALIVE_INTERVAL", 15))
+
+# Фильтр Блума для проверки VIN: ожидаемое число VIN и доля ложных срабатываний
+VIN_FILTER_CAPACITY = int(os.getenv("VIN_FILTER_CAPACITY", 1000000))
+VIN_FILTER_ERROR_RATE = float(os.getenv("VIN_FILTER_ERROR_RATE", 0.01))
+
+# Наибольшее число анкет в одном запросе пакетного принятия
+ANKETA_BATCH_LIMIT = int(os.getenv("ANKETA_BATCH_LIMIT", 500))
+
+# Пакетный импорт автомобилей: строк в одной транзакции и сколько ошибок
+# по строкам возвращать в ответе (считаются все)
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", 1000))
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", 1000))
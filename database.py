@@ -1,5 +1,10 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 import pymysql as mysql
-from peewee import MySQLDatabase
+from playhouse.pool import PooledMySQLDatabase
 from pymysql import MySQLError
 
 
@@ -9,6 +14,11 @@ DB_USER = "root"
 DB_PASSWORD = "root"
 DB_NAME = "BazaDannih"
 
+# Настройки пула соединений (можно переопределить переменными окружения)
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 20))
+DB_STALE_TIMEOUT = int(os.getenv("DB_STALE_TIMEOUT", 300))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 10))
+
 
 def create_database():
     """Создания базы данных"""
@@ -29,10 +39,74 @@ def create_database():
 
 create_database()
 
-database_connection = MySQLDatabase(
+
+class QueryStats:
+    """Количество SQL-запросов и суммарное время их выполнения"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def record(self, duration: float):
+        self.count += 1
+        self.duration += duration
+
+
+query_stats: ContextVar = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def count_queries():
+    """Подсчет SQL-запросов, выполненных внутри блока with"""
+    stats = QueryStats()
+    reset_token = query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        query_stats.reset(reset_token)
+
+
+class QueryCountingMixin:
+    """Учитывает каждый выполненный запрос в текущем QueryStats"""
+
+    def execute_sql(self, sql, *args, **kwargs):
+        stats = query_stats.get()
+        if stats is None:
+            return super().execute_sql(sql, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            stats.record(time.perf_counter() - started)
+
+
+class CountingPooledMySQLDatabase(QueryCountingMixin, PooledMySQLDatabase):
+    pass
+
+
+# Пул соединений: при выдаче соединения из пула PooledMySQLDatabase
+# проверяет его через ping, поэтому "server has gone away" не доходит
+# до запроса - мертвое соединение просто заменяется новым.
+database_connection = CountingPooledMySQLDatabase(
     DB_NAME,
     user=DB_USER,
     password=DB_PASSWORD,
     host=DB_HOST,
     port=DB_PORT,
-)
\ No newline at end of file
+    max_connections=DB_MAX_CONNECTIONS,
+    stale_timeout=DB_STALE_TIMEOUT,
+    timeout=DB_POOL_TIMEOUT,
+)
+
+
+def get_pool_stats():
+    """Статистика пула соединений для подбора его размера"""
+    in_use = len(database_connection._in_use)
+    idle = len(database_connection._connections)
+    return {
+        "max_connections": database_connection._max_connections,
+        "stale_timeout": database_connection._stale_timeout,
+        "in_use": in_use,
+        "idle": idle,
+        "total": in_use + idle,
+    }
@@ -21,6 +21,8 @@ class CarTradingApp:
         
         self.auth_token = None
         self.current_user = None
+        # Страницы списков с ETag: (путь, параметры) -> (ETag, ответ, страница)
+        self.page_cache = {}
         self.selected_user = None
         self.selected_stamp = None 
         self.selected_model = None 
@@ -239,6 +241,60 @@ class CarTradingApp:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка при экспорте: {str(e)}")
 
+    def get_all_pages(self, path, headers, params=None):
+        """Загрузить все страницы списка из API; возвращает (последний ответ, элементы)"""
+        items = []
+        params = dict(params or {})
+        while True:
+            key = (path, tuple(sorted(params.items())))
+            cached = self.page_cache.get(key)
+            request_headers = dict(headers)
+            if cached:
+                request_headers["If-None-Match"] = cached[0]
+            response = requests.get(f"{API_BASE_URL}{path}", headers=request_headers, params=params)
+            if response.status_code == 304 and cached:
+                # Список не изменился: используем сохраненную страницу
+                _, response, page = cached
+            elif response.status_code != 200:
+                return response, items
+            else:
+                page = response.json()
+                if response.headers.get("ETag"):
+                    self.page_cache[key] = (response.headers["ETag"], response, page)
+            items.extend(page["items"])
+            if not page.get("next_cursor"):
+                return response, items
+            params["cursor"] = page["next_cursor"]
+
+    def get_car_filter_params(self):
+        """Параметры фильтрации и сортировки для запроса каталога к API"""
+        params = {}
+
+        if hasattr(self, 'filter_stamp_combo') and self.filter_stamp_combo.get():
+            params['stamp'] = self.filter_stamp_combo.get()
+
+        if hasattr(self, 'filter_model_combo') and self.filter_model_combo.get():
+            params['model'] = self.filter_model_combo.get()
+
+        if hasattr(self, 'filter_price_entry') and self.filter_price_entry.get():
+            try:
+                params['max_price'] = int(self.filter_price_entry.get())
+            except ValueError:
+                pass
+
+        if hasattr(self, 'sort_combo'):
+            sort_options = {
+                "Цена (по возрастанию)": "price_asc",
+                "Цена (по убыванию)": "price_desc",
+                "Пробег (по возрастанию)": "run_asc",
+                "Пробег (по убыванию)": "run_desc",
+            }
+            sort = sort_options.get(self.sort_combo.get())
+            if sort:
+                params['sort'] = sort
+
+        return params
+
     def apply_car_filters(self, cars):
         """Применить фильтры и сортировку к списку автомобилей"""
         filtered_cars = cars.copy()
@@ -416,14 +472,12 @@ class CarTradingApp:
         try:
             headers = {"token": self.auth_token}
 
-            response = requests.get(f"{API_BASE_URL}/users/cars/available", headers=headers)
+            response, available_cars = self.get_all_pages("/users/cars/available", headers)
             if response.status_code == 200:
-                available_cars = response.json()
                 stats['available_cars'] = len(available_cars)
 
-            response = requests.get(f"{API_BASE_URL}/admin/sales/", headers=headers)
+            response, firm_sales = self.get_all_pages("/admin/sales/", headers)
             if response.status_code == 200:
-                firm_sales = response.json()
                 stats['firm_purchased_cars'] = len(firm_sales)
 
                 total_revenue = 0
@@ -441,9 +495,8 @@ class CarTradingApp:
                         'price': sale.get('price', 0),
                         'date': sale.get('date_sale', '')[:10]
                     })
-            response = requests.get(f"{API_BASE_URL}/admin/shopping/", headers=headers)
+            response, firm_purchases = self.get_all_pages("/admin/shopping/", headers)
             if response.status_code == 200:
-                firm_purchases = response.json()
                 stats['firm_solds_cars'] = len(firm_purchases)
 
                 total_purchase_cost = 0
@@ -1278,18 +1331,19 @@ class CarTradingApp:
         """Загрузить и отобразить список доступных автомобилей"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/users/cars/available", headers=headers)
+            params = self.get_car_filter_params()
+            response, cars = self.get_all_pages("/users/cars/available", headers, params)
             
             if response.status_code == 200:
-                cars = response.json()
-
-                self.original_cars_data = cars
+                if not any(key in params for key in ('stamp', 'model', 'max_price')):
+                    self.original_cars_data = cars
 
-                if cars and hasattr(self, 'filter_stamp_combo'):
-                    stamps = list(set(car.get('stamp', '') for car in cars if car.get('stamp')))
-                    self.filter_stamp_combo['values'] = stamps
+                    if cars and hasattr(self, 'filter_stamp_combo'):
+                        stamps = list(set(car.get('stamp', '') for car in cars if car.get('stamp')))
+                        self.filter_stamp_combo['values'] = stamps
 
-                filtered_cars = self.apply_car_filters(cars)
+                self.filtered_cars = cars
+                filtered_cars = cars
                 
                 if not filtered_cars:
                     no_cars_label = tk.Label(parent_frame, 
@@ -1863,17 +1917,13 @@ class CarTradingApp:
         try:
             headers = {"token": self.auth_token}
 
-            response = requests.get(f"{API_BASE_URL}/admin/stamps/", headers=headers)
-            if response.status_code == 200:
-                self.car_stamps = response.json()
-            else:
+            response, self.car_stamps = self.get_all_pages("/admin/stamps/", headers)
+            if response.status_code != 200:
                 self.car_stamps = []
                 print(f"Ошибка загрузки марок: {response.status_code}")
 
-            response = requests.get(f"{API_BASE_URL}/admin/models/", headers=headers)
-            if response.status_code == 200:
-                self.car_models = response.json()
-            else:
+            response, self.car_models = self.get_all_pages("/admin/models/", headers)
+            if response.status_code != 200:
                 self.car_models = []
                 print(f"Ошибка загрузки моделей: {response.status_code}")
                 
@@ -2125,11 +2175,9 @@ class CarTradingApp:
         """Загрузить и отобразить анкеты в стиле пользовательского интерфейса"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/anketi/", headers=headers)
+            response, anketi = self.get_all_pages("/admin/anketi/", headers)
             
             if response.status_code == 200:
-                anketi = response.json()
-                
                 if not anketi:
                     no_anketi_label = tk.Label(parent_frame, 
                                             text="Нет анкет от пользователей",
@@ -2309,11 +2357,9 @@ class CarTradingApp:
         """Загрузить и отобразить таблицу пользователей с Treeview"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/users/list_users/", headers=headers)
+            response, users = self.get_all_pages("/users/list_users/", headers)
             
             if response.status_code == 200:
-                users = response.json()
-                
                 if not users:
                     no_users_label = tk.Label(parent_frame, 
                                             text="В системе нет других пользователей",
@@ -2845,11 +2891,9 @@ class CarTradingApp:
         """Загрузить и отобразить все покупки в Treeview"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/shopping/", headers=headers)
+            response, purchases = self.get_all_pages("/admin/shopping/", headers)
             
             if response.status_code == 200:
-                purchases = response.json()
-                
                 if not purchases:
                     no_data_label = tk.Label(parent_frame, 
                                         text="Нет данных о покупках",
@@ -2965,11 +3009,9 @@ class CarTradingApp:
         """Загрузить и отобразить все продажи в Treeview"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/sales/", headers=headers)
+            response, sales = self.get_all_pages("/admin/sales/", headers)
             
             if response.status_code == 200:
-                sales = response.json()
-                
                 if not sales:
                     no_data_label = tk.Label(parent_frame, 
                                         text="Нет данных о продажах",
@@ -3184,11 +3226,9 @@ class CarTradingApp:
         """Загрузить и отобразить все автомобили для администратора"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/cars/", headers=headers)
+            response, cars = self.get_all_pages("/admin/cars/", headers)
             
             if response.status_code == 200:
-                cars = response.json()
-
                 self.original_cars_data = cars
 
                 if cars:
@@ -3227,11 +3267,9 @@ class CarTradingApp:
         """Загрузить и отобразить все анкеты для администратора"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/anketi/", headers=headers)
+            response, anketi = self.get_all_pages("/admin/anketi/", headers)
             
             if response.status_code == 200:
-                anketi = response.json()
-                
                 if not anketi:
                     no_anketi_label = tk.Label(parent_frame, 
                                             text="Нет анкет от пользователей",
@@ -3699,11 +3737,9 @@ class CarTradingApp:
         """Загрузить и отобразить таблицу марок с Treeview"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/stamps/", headers=headers)
+            response, stamps = self.get_all_pages("/admin/stamps/", headers)
             
             if response.status_code == 200:
-                stamps = response.json()
-                
                 if not stamps:
                     no_stamps_label = tk.Label(parent_frame, 
                                             text="В системе нет марок автомобилей",
@@ -4062,11 +4098,9 @@ class CarTradingApp:
         """Загрузить и отобразить таблицу моделей с Treeview"""
         try:
             headers = {"token": self.auth_token}
-            response = requests.get(f"{API_BASE_URL}/admin/models/", headers=headers)
+            response, models = self.get_all_pages("/admin/models/", headers)
             
             if response.status_code == 200:
-                models = response.json()
-                
                 if not models:
                     no_models_label = tk.Label(parent_frame, 
                                             text="В системе нет моделей автомобилей",
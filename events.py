@@ -0,0 +1,98 @@
+"""Push-уведомления клиентов об изменениях через Server-Sent Events.
+
+Обработчики публикуют события после фиксации транзакции из пула потоков,
+а рассылка выполняется в event loop: сообщение сериализуется один раз и
+кладется в ограниченные очереди подписчиков, поэтому стоимость события
+линейна по числу подписчиков и не зависит от медленных клиентов. Если
+очередь подписчика переполнена, ее содержимое заменяется событием resync:
+клиент догоняет изменения через /users/cars/changes.
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+
+from config import EVENT_QUEUE_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+RESYNC_MESSAGE = "event: resync\ndata: {}\n\n"
+
+
+class Subscriber:
+    """Очередь сообщений одного открытого SSE-соединения"""
+
+    def __init__(self, role: Optional[str], types: Optional[set], queue_size: int):
+        self.role = role
+        self.types = types
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_MESSAGE)
+
+
+class EventBroker:
+    """Подписчики, сгруппированные по роли, и рассылка им событий"""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._loop = None
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def bind(self, loop: Optional[asyncio.AbstractEventLoop]):
+        """Запомнить event loop приложения (None - отключить рассылку)"""
+        self._loop = loop
+
+    def subscribe(self, role: Optional[str], types: Optional[Iterable[str]] = None) -> Subscriber:
+        subscriber = Subscriber(role, set(types) if types else None, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(role, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            group = self._subscribers.get(subscriber.role)
+            if group is not None:
+                group.discard(subscriber)
+                if not group:
+                    del self._subscribers[subscriber.role]
+
+    def publish(self, event_type: str, data: dict, roles: Optional[Iterable[str]] = None):
+        """Отправить событие подписчикам с ролями roles (None - всем); потокобезопасно"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        message = f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        roles = set(roles) if roles is not None else None
+        try:
+            loop.call_soon_threadsafe(self._dispatch, event_type, message, roles)
+        except RuntimeError:
+            logger.debug("Event loop остановлен, событие %s не отправлено", event_type)
+
+    def _dispatch(self, event_type: str, message: str, roles: Optional[set]):
+        # Подписка и отписка тоже выполняются в event loop, поэтому
+        # множества подписчиков не меняются во время обхода.
+        self.published += 1
+        for role, group in self._subscribers.items():
+            if roles is not None and role not in roles:
+                continue
+            for subscriber in group:
+                if subscriber.types is None or event_type in subscriber.types:
+                    subscriber.offer(message)
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = {role or "": len(group) for role, group in self._subscribers.items()}
+        return {"subscribers": subscribers, "published": self.published}
+
+
+broker = EventBroker()
@@ -0,0 +1,102 @@
+"""Хеширование паролей в отдельном пуле процессов.
+
+argon2 намеренно нагружает процессор, поэтому хеширование и проверка
+паролей вынесены из потоков API в ограниченный пул процессов.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from config import (
+    ARGON2_MEMORY_COST,
+    ARGON2_PARALLELISM,
+    ARGON2_TIME_COST,
+    HASHER_PROCESSES,
+)
+from metrics import password_hash_duration_seconds
+
+
+ph = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _hash(password: str) -> str:
+    return ph.hash(password)
+
+
+def _verify(hashed_password: str, password: str) -> bool:
+    try:
+        return ph.verify(hashed_password, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def _ready() -> bool:
+    return True
+
+
+def _mp_context():
+    # fork из многопоточного сервера копирует чужие блокировки в дочерний
+    # процесс; forkserver запускает процессы из чистого однопоточного сервера
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Пул процессов для хеширования (создается при первом обращении)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=HASHER_PROCESSES, mp_context=_mp_context())
+        return _executor
+
+
+def start_executor():
+    """Создать пул и сразу запустить все процессы, чтобы первые входы их не ждали"""
+    executor = get_executor()
+    wait([executor.submit(_ready) for _ in range(HASHER_PROCESSES)])
+
+
+def shutdown_executor():
+    """Остановка пула процессов при завершении приложения"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def hash_password(password: str) -> str:
+    """Хеширование пароля"""
+    started = time.perf_counter()
+    try:
+        return get_executor().submit(_hash, password).result()
+    finally:
+        password_hash_duration_seconds.observe(time.perf_counter() - started, "hash")
+
+
+def verify_password(hashed_password: str, password: str) -> bool:
+    """Проверка пароля по хешу"""
+    started = time.perf_counter()
+    try:
+        return get_executor().submit(_verify, hashed_password, password).result()
+    finally:
+        password_hash_duration_seconds.observe(time.perf_counter() - started, "verify")
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Хеш создан с устаревшими параметрами argon2"""
+    try:
+        return ph.check_needs_rehash(hashed_password)
+    except InvalidHashError:
+        return True
@@ -0,0 +1,116 @@
+"""Журнал изменений автомобилей для дельта-синхронизации клиентов.
+
+Обработчики, которые добавляют, изменяют, продают или удаляют автомобили,
+записывают изменение в CarChange в той же транзакции. Клиент хранит id
+последней полученной записи и запрашивает только то, что изменилось
+после него: выборка идет по первичному ключу журнала. Открытые клиенты
+дополнительно получают push-уведомление (events.py). В той же транзакции
+обновляются поисковые документы CarSearch и витрина каталога CarCatalog.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from config import CAR_CHANGES_SETTLE_SECONDS
+from events import broker
+from models import Cars, CarChange, CarSearch, CarCatalog
+
+
+ADDED = "added"
+UPDATED = "updated"
+SOLD = "sold"
+DELETED = "deleted"
+
+
+def record_car_changes(car_ids: Iterable[int], action: str):
+    """Записать изменение автомобилей; вызывать внутри транзакции изменения"""
+    car_ids = list(car_ids)
+    if not car_ids:
+        return
+    # Строки удаленных автомобилей убирает внешний ключ ON DELETE CASCADE
+    if action in (ADDED, UPDATED):
+        CarSearch.refresh(car_ids)
+    if action in (ADDED, UPDATED, SOLD):
+        CarCatalog.refresh(car_ids)
+    # Журнал - последним, чтобы id записи выдавался как можно ближе к фиксации
+    CarChange.insert_many([{"car_id": car_id, "action": action} for car_id in car_ids]).execute()
+
+
+def record_renamed_cars(condition) -> list:
+    """Записать изменение автомобилей, отобранных condition, при переименовании марки или модели.
+
+    Название входит в карточки и поисковые документы автомобилей. Вызывать
+    в транзакции переименования после UPDATE справочника: его строка уже
+    заблокирована, поэтому автомобиль со старым названием не добавится
+    между выборкой и фиксацией. Возвращает id автомобилей для уведомления.
+    """
+    car_ids = [car_id for car_id, in Cars.select(Cars.id).where(condition).tuples()]
+    record_car_changes(car_ids, UPDATED)
+    return car_ids
+
+
+def _settle_cutoff() -> datetime:
+    """Записи журнала новее этого момента еще могут соседствовать с незафиксированными.
+
+    id выдается при вставке, а виден становится при фиксации: транзакция,
+    получившая меньший id, может зафиксироваться позже большего. Курсор не
+    продвигается за записи моложе CAR_CHANGES_SETTLE_SECONDS, иначе клиент
+    пропустил бы такое изменение навсегда.
+    """
+    return datetime.now() - timedelta(seconds=CAR_CHANGES_SETTLE_SECONDS)
+
+
+def latest_change_id() -> int:
+    """Курсор, начиная с которого клиент получит только будущие изменения"""
+    return (CarChange
+            .select(CarChange.id)
+            .where(CarChange.changed_at <= _settle_cutoff())
+            .order_by(CarChange.id.desc())
+            .scalar()) or 0
+
+
+def changes_since(since: int, limit: int):
+    """Изменения после курсора since: ({car_id: последнее действие}, новый курсор, есть ли еще).
+
+    Свежие записи отдаются сразу, но курсор остается перед ними: клиент
+    получит их повторно, зато не пропустит изменение, зафиксированное позже.
+    """
+    rows = list(CarChange
+                .select(CarChange.id, CarChange.car_id, CarChange.action, CarChange.changed_at)
+                .where(CarChange.id > since)
+                .order_by(CarChange.id)
+                .limit(limit + 1)
+                .tuples())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cutoff = _settle_cutoff()
+    actions = {}
+    cursor: Optional[int] = since
+    settled = True
+    for change_id, car_id, action, changed_at in rows:
+        # Новое добавление после удаления и наоборот: важно только последнее действие
+        actions.pop(car_id, None)
+        actions[car_id] = action
+        settled = settled and changed_at <= cutoff
+        if settled:
+            cursor = change_id
+    # Пока курсор стоит перед свежими записями, следующая страница была бы той же
+    return actions, cursor, has_more and settled
+
+
+def publish_car_changes(car_ids: Iterable[int], action: str):
+    """Уведомить подписчиков SSE об изменении; вызывать после фиксации транзакции"""
+    broker.publish("cars", {"action": action, "car_ids": list(car_ids)})
+
+
+# Не больше стольких слов в поисковом запросе
+MAX_SEARCH_TERMS = 10
+
+
+def search_expression(query: str) -> str:
+    """Запрос MATCH ... AGAINST в BOOLEAN MODE: каждое слово обязательно и ищется по префиксу.
+
+    Операторы булева режима из пользовательской строки отбрасываются.
+    """
+    terms = re.findall(r"\w+", query)[:MAX_SEARCH_TERMS]
+    return " ".join(f"+{term}*" for term in terms)
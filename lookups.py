@@ -0,0 +1,163 @@
+"""Кэш справочных таблиц (Status, Roles, Stamp, ModelCar) в памяти процесса.
+
+Справочники маленькие и меняются редко, поэтому они целиком загружаются
+в словари название <-> id при старте и перечитываются по истечении
+LOOKUP_CACHE_TTL. Марки и модели, кроме того, перечитываются, как только
+изменится версия их коллекции (versions.py): ее увеличивает любой процесс
+API, переименовавший или удаливший запись, поэтому остальные процессы не
+сопоставят старое название с id переименованной или удаленной записи.
+"""
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+from config import LOOKUP_CACHE_TTL
+from database import database_connection
+from models import Status, Roles, Stamp, ModelCar
+from versions import collection_versions, STAMPS, MODELS
+
+
+logger = logging.getLogger(__name__)
+
+
+class LookupTable:
+    """Двусторонний словарь название <-> id для одной справочной таблицы"""
+
+    def __init__(self, model, name_field, collection: Optional[str] = None, ttl: int = LOOKUP_CACHE_TTL):
+        self.model = model
+        self.name_field = name_field
+        self.collection = collection
+        self.ttl = ttl
+        self._ids = {}
+        self._names = {}
+        self._loaded_at = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Загрузить таблицу целиком"""
+        # Версия читается до таблицы: изменение во время загрузки вызовет еще одну
+        version = self._current_version()
+        rows = list(self.model.select(self.model.id, self.name_field).tuples())
+        with self._lock:
+            self._ids = {name: row_id for row_id, name in rows}
+            self._names = {row_id: name for row_id, name in rows}
+            self._loaded_at = time.monotonic()
+            self._version = version
+
+    def invalidate(self):
+        """Сбросить кэш; таблица перечитается при следующем обращении"""
+        with self._lock:
+            self._loaded_at = None
+
+    def get_id(self, name: str) -> Optional[int]:
+        """id записи по названию"""
+        self._ensure_loaded()
+        with self._lock:
+            row_id = self._ids.get(name)
+            if row_id is not None:
+                self.hits += 1
+                return row_id
+            self.misses += 1
+        row = self.model.get_or_none(self.name_field == name)
+        if row is None:
+            return None
+        self._remember(row.id, name)
+        return row.id
+
+    def get_name(self, row_id: int) -> Optional[str]:
+        """Название записи по id"""
+        self._ensure_loaded()
+        with self._lock:
+            name = self._names.get(row_id)
+            if name is not None:
+                self.hits += 1
+                return name
+            self.misses += 1
+        row = self.model.get_or_none(self.model.id == row_id)
+        if row is None:
+            return None
+        name = getattr(row, self.name_field.name)
+        self._remember(row_id, name)
+        return name
+
+    def get_or_create_id(self, name: str) -> Tuple[int, bool]:
+        """(id, created) записи по названию; запись создается, если ее еще нет"""
+        row_id = self.get_id(name)
+        if row_id is not None:
+            return row_id, False
+        row, created = self.model.get_or_create(**{self.name_field.name: name})
+        self._remember(row.id, name)
+        return row.id, created
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._ids), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, row_id: int, name: str):
+        with self._lock:
+            self._ids[name] = row_id
+            self._names[row_id] = name
+
+    def _current_version(self) -> Optional[str]:
+        return collection_versions.get(self.collection) if self.collection else None
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if (loaded_at is None or time.monotonic() - loaded_at > self.ttl
+                or self._version != self._current_version()):
+            self.load()
+
+
+statuses = LookupTable(Status, Status.status)
+roles = LookupTable(Roles, Roles.name)
+stamps = LookupTable(Stamp, Stamp.stamp, STAMPS)
+car_models = LookupTable(ModelCar, ModelCar.model_car, MODELS)
+
+lookup_tables = {
+    "statuses": statuses,
+    "roles": roles,
+    "stamps": stamps,
+    "models": car_models,
+}
+
+
+def resolve_car_dimensions(stamp: str, model_car: str) -> Tuple[int, int]:
+    """id марки и модели автомобиля по названиям; недостающие записи создаются.
+
+    Вызывать до транзакции, в которой создается автомобиль: запись справочника,
+    созданная внутри нее, попала бы в кэш, и после отката транзакции кэш
+    выдавал бы несуществующий id. Версия справочника меняется, только если
+    в нем появилась новая запись.
+    """
+    stamp_id, stamp_created = stamps.get_or_create_id(stamp)
+    model_car_id, model_created = car_models.get_or_create_id(model_car)
+    created = [STAMPS] if stamp_created else []
+    if model_created:
+        created.append(MODELS)
+    if created:
+        collection_versions.bump(*created)
+    return stamp_id, model_car_id
+
+
+def warm_up_lookups():
+    """Загрузить все справочники при старте приложения"""
+    try:
+        with database_connection.connection_context():
+            for table in lookup_tables.values():
+                table.load()
+    except Exception:
+        logger.exception("Не удалось загрузить справочники, они загрузятся при первом обращении")
+
+
+def get_lookup_stats() -> dict:
+    hits = sum(table.hits for table in lookup_tables.values())
+    misses = sum(table.misses for table in lookup_tables.values())
+    total = hits + misses
+    return {
+        "tables": {name: table.stats() for name, table in lookup_tables.items()},
+        "hit_ratio": hits / total if total else 0.0,
+    }
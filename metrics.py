@@ -0,0 +1,231 @@
+"""Метрики API в текстовом формате Prometheus.
+
+Счетчики живут в памяти процесса, обновление метрики - это словарь и
+блокировка, без обращений к внешним сервисам. При запуске нескольких
+процессов (uvicorn --workers) каждый процесс сохраняет снимок своих
+метрик в общий локальный каталог METRICS_DIR, а /metrics суммирует снимки.
+Снимки завершившихся процессов удаляются.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(labels): value for labels, value in self._values.items()}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = {
+                    "buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0,
+                }
+            state["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                json.dumps(labels): {"buckets": list(state["buckets"]),
+                                     "sum": state["sum"], "count": state["count"]}
+                for labels, state in self._values.items()
+            }
+
+
+registry = []
+# Функции, возвращающие {имя счетчика: значение} на момент снимка
+# (счетчики кэшей, которые ведутся в самих кэшах)
+collectors = []
+
+
+http_requests_total = Counter(
+    "http_requests_total", "Количество запросов к API", ("method", "route", "status"))
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Время обработки запроса к API", ("method", "route"))
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Запросы к API, которые обрабатываются сейчас")
+db_queries_total = Counter(
+    "db_queries_total", "Количество SQL-запросов", ("route",))
+db_request_duration_seconds = Histogram(
+    "db_request_duration_seconds", "Время работы с БД за один запрос к API", ("route",))
+password_hash_duration_seconds = Histogram(
+    "password_hash_duration_seconds", "Время хеширования и проверки паролей argon2",
+    ("operation",), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+def process_snapshot() -> dict:
+    """Снимок метрик текущего процесса"""
+    snapshot = {"pid": os.getpid(), "metrics": {}, "collected": {}}
+    for metric in registry:
+        snapshot["metrics"][metric.name] = metric.snapshot()
+    for collector in collectors:
+        snapshot["collected"].update(collector())
+    return snapshot
+
+
+def write_snapshot():
+    """Сохранить снимок процесса в METRICS_DIR (атомарно, через переименование)"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as snapshot_file:
+        json.dump(process_snapshot(), snapshot_file)
+    os.replace(path + ".tmp", path)
+
+
+# Живой процесс обновляет снимок каждые METRICS_FLUSH_INTERVAL секунд
+SNAPSHOT_MAX_AGE = 3 * METRICS_FLUSH_INTERVAL
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _snapshot_alive(path: str, pid: int) -> bool:
+    """Процесс снимка жив: pid существует и снимок обновлялся недавно.
+
+    Давно не обновлявшийся снимок при живом pid - pid занял другой процесс.
+    """
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+    return age <= SNAPSHOT_MAX_AGE and _process_alive(pid)
+
+
+def _load_snapshots() -> list:
+    if not METRICS_DIR:
+        return [process_snapshot()]
+    write_snapshot()
+    snapshots = []
+    for filename in os.listdir(METRICS_DIR):
+        pid, _, extension = filename.partition(".")
+        if extension != "json" or not pid.isdigit():
+            continue
+        path = os.path.join(METRICS_DIR, filename)
+        if not _snapshot_alive(path, int(pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as snapshot_file:
+                snapshots.append(json.load(snapshot_file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_metrics() -> str:
+    """Все метрики всех процессов в текстовом формате Prometheus"""
+    snapshots = _load_snapshots()
+    lines = []
+    for metric in registry:
+        merged = {}
+        for snapshot in snapshots:
+            for labels, value in snapshot["metrics"].get(metric.name, {}).items():
+                if metric.kind == "histogram":
+                    state = merged.setdefault(labels, {
+                        "buckets": [0] * (len(metric.buckets) + 1), "sum": 0.0, "count": 0,
+                    })
+                    state["buckets"] = [a + b for a, b in zip(state["buckets"], value["buckets"])]
+                    state["sum"] += value["sum"]
+                    state["count"] += value["count"]
+                else:
+                    merged[labels] = merged.get(labels, 0.0) + value
+
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels_json, value in sorted(merged.items()):
+            labels = json.loads(labels_json)
+            if metric.kind != "histogram":
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + ("+Inf",), value["buckets"]):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(metric.labelnames, labels, [("le", bound)])
+                lines.append(f"{metric.name}_bucket{bucket_labels} {cumulative}")
+            plain_labels = _format_labels(metric.labelnames, labels)
+            lines.append(f"{metric.name}_sum{plain_labels} {value['sum']}")
+            lines.append(f"{metric.name}_count{plain_labels} {value['count']}")
+
+    collected = {}
+    for snapshot in snapshots:
+        for name, value in snapshot["collected"].items():
+            collected[name] = collected.get(name, 0.0) + value
+    for name, value in sorted(collected.items()):
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    for name, hits in sorted(collected.items()):
+        if not name.endswith("_hits_total"):
+            continue
+        prefix = name[:-len("_hits_total")]
+        total = hits + collected.get(f"{prefix}_misses_total", 0.0)
+        lines.append(f"# TYPE {prefix}_hit_ratio gauge")
+        lines.append(f"{prefix}_hit_ratio {hits / total if total else 0.0}")
+    return "\n".join(lines) + "\n"
@@ -6,7 +6,12 @@ from peewee import (
     DateTimeField,
     ForeignKeyField,
     AutoField,
+    TextField,
+    Field,
+    fn,
 )
+from playhouse.migrate import MySQLMigrator, migrate
+from config import CAR_CATALOG_REBUILD
 from database import database_connection
 from datetime import datetime
 
@@ -34,9 +39,9 @@ class Users(Table):
 class UserToken(Table):
     id = AutoField()
     user_id = ForeignKeyField(Users, on_delete="CASCADE", on_update="CASCADE", null=False)
-    token = CharField(max_length=255, null=False)
+    token = CharField(max_length=255, null=False, unique=True)
     created_at = DateTimeField(default=datetime.now, null=False)
-    expires_at = DateTimeField(null=False)
+    expires_at = DateTimeField(null=False, index=True)
 
 
 class Roles(Table):
@@ -112,6 +117,97 @@ class Anketa(Table):
     vin = CharField(unique=True, null=False)
     description = CharField(max_length=500, null=True)
 
+
+class CarChange(Table):
+    """Журнал изменений автомобилей для синхронизации клиентов по курсору (id записи)."""
+
+    id = AutoField()
+    # Без внешнего ключа: запись об удалении должна пережить сам автомобиль
+    car_id = IntegerField(null=False)
+    action = CharField(max_length=10, null=False)
+    changed_at = DateTimeField(default=datetime.now, null=False)
+
+class CarSearch(Table):
+    """Поисковый документ автомобиля: марка, модель, VIN и описание одной строкой.
+
+    По столбцу document строится индекс FULLTEXT (см. migrate_search_index).
+    """
+
+    car_id = ForeignKeyField(Cars, primary_key=True, on_delete="CASCADE", on_update="CASCADE")
+    document = TextField(null=False)
+
+    @classmethod
+    def refresh(cls, car_ids=None):
+        """Пересобрать документы автомобилей car_ids (список или подзапрос; None - всех)"""
+        query = (Cars
+                 .select(Cars.id, fn.CONCAT_WS(' ', Stamp.stamp, ModelCar.model_car,
+                                               Cars.vin, Cars.description))
+                 .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+                 .switch(Cars)
+                 .join(ModelCar, on=(Cars.model_car_id == ModelCar.id)))
+        if car_ids is not None:
+            query = query.where(Cars.id.in_(car_ids))
+        return cls.insert_from(query, [cls.car_id, cls.document]).on_conflict_replace().execute()
+
+class CarCatalog(Table):
+    """Витрина каталога: автомобиль с названиями марки, модели и статуса.
+
+    Списки и карточки автомобилей читаются отсюда одной таблицей, без
+    соединений со справочниками. Строки пересобирает refresh в транзакции
+    изменения автомобиля (inventory.record_car_changes), удаленные
+    автомобили убирает внешний ключ ON DELETE CASCADE. Поэтому все
+    изменения Cars должны проходить через record_car_changes; после правки
+    таблицы в обход нее витрину пересобирает запуск с CAR_CATALOG_REBUILD=1.
+    """
+
+    id = ForeignKeyField(Cars, primary_key=True, column_name="id", on_delete="CASCADE", on_update="CASCADE")
+    stamp = CharField(max_length=50)
+    model_car = CharField(max_length=50)
+    run_km = IntegerField()
+    vin = CharField()
+    status = CharField(max_length=20)
+    price = IntegerField()
+    description = CharField(max_length=500, null=True)
+
+    class Meta:
+        table_name = "car_catalog"
+        indexes = (
+            # Каталог по статусу с сортировкой по цене/пробегу
+            (('status', 'price'), False),
+            (('status', 'run_km'), False),
+            # То же с фильтром по марке или модели
+            (('status', 'stamp', 'price'), False),
+            (('status', 'model_car', 'price'), False),
+        )
+
+    @classmethod
+    def refresh(cls, car_ids=None):
+        """Пересобрать строки автомобилей car_ids (список или подзапрос; None - всех)"""
+        query = (Cars
+                 .select(Cars.id, Stamp.stamp, ModelCar.model_car, Cars.run_km, Cars.vin,
+                         Status.status, Cars.price, Cars.description)
+                 .join(Stamp, on=(Cars.stamp_id == Stamp.id))
+                 .switch(Cars)
+                 .join(ModelCar, on=(Cars.model_car_id == ModelCar.id))
+                 .switch(Cars)
+                 .join(Status, on=(Cars.status_id == Status.id)))
+        if car_ids is not None:
+            query = query.where(Cars.id.in_(car_ids))
+        return cls.insert_from(query, [cls.id, cls.stamp, cls.model_car, cls.run_km, cls.vin,
+                                       cls.status, cls.price, cls.description]).on_conflict_replace().execute()
+
+class VinRegistry(Table):
+    """Все занятые VIN: автомобили и анкеты в одном уникальном индексе.
+
+    Заполнен ровно один из car_id/anketa_id; при удалении автомобиля
+    или анкеты запись удаляется каскадом.
+    """
+
+    id = AutoField()
+    vin = CharField(unique=True, null=False)
+    car_id = ForeignKeyField(Cars, null=True, on_delete="CASCADE", on_update="CASCADE")
+    anketa_id = ForeignKeyField(Anketa, null=True, on_delete="CASCADE", on_update="CASCADE")
+
 tables = [
     Users,
     UserToken,
@@ -124,9 +220,100 @@ tables = [
     Shopping,
     Sales,
     Anketa,
+    CarChange,
+    CarSearch,
+    CarCatalog,
+    VinRegistry,
 ]
 
 
+def migrate_indexes():
+    """Добавление индексов, которых нет в уже существующих таблицах.
+
+    create_tables(safe=True) не трогает существующие таблицы, поэтому
+    индексы, объявленные в моделях позже, создаются здесь.
+    """
+    migrator = MySQLMigrator(database_connection)
+    for model in tables:
+        table_name = model._meta.table_name
+        existing = {
+            tuple(index.columns)
+            for index in database_connection.get_indexes(table_name)
+        }
+        for index in model._meta.fields_to_index():
+            if not all(isinstance(field, Field) for field in index._expressions):
+                continue
+            columns = tuple(field.column_name for field in index._expressions)
+            if columns in existing:
+                continue
+            try:
+                migrate(migrator.add_index(table_name, columns, index._unique))
+                print(f'Index {table_name}{columns} is created')
+            except Exception as e:
+                print(f'Error creating index {table_name}{columns}: {e}')
+
+
+SEARCH_INDEX_NAME = 'carsearch_document_fulltext'
+
+
+def migrate_search_index():
+    """Индекс FULLTEXT для поиска и первичное заполнение CarSearch"""
+    table_name = CarSearch._meta.table_name
+    existing = {index.name for index in database_connection.get_indexes(table_name)}
+    if SEARCH_INDEX_NAME not in existing:
+        try:
+            database_connection.execute_sql(
+                f'CREATE FULLTEXT INDEX {SEARCH_INDEX_NAME} ON {table_name} (document)')
+            print(f'Index {SEARCH_INDEX_NAME} is created')
+        except Exception as e:
+            print(f'Error creating index {SEARCH_INDEX_NAME}: {e}')
+    if not CarSearch.select().exists() and Cars.select().exists():
+        CarSearch.refresh()
+        print('Search index is filled')
+
+
+def migrate_vin_registry():
+    """Перенос в VinRegistry VIN автомобилей и анкет, которых в нем еще нет"""
+    if VinRegistry.select().count() >= Cars.select().count() + Anketa.select().count():
+        return
+    VinRegistry.insert_from(
+        Cars.select(Cars.vin, Cars.id),
+        [VinRegistry.vin, VinRegistry.car_id]).on_conflict_ignore().execute()
+    VinRegistry.insert_from(
+        Anketa.select(Anketa.vin, Anketa.id),
+        [VinRegistry.vin, VinRegistry.anketa_id]).on_conflict_ignore().execute()
+    print('VIN registry is filled')
+
+
+# Индексы, которые больше не нужны: каталог читается из CarCatalog
+OBSOLETE_INDEXES = {
+    Cars: [('status_id', 'price'), ('status_id', 'run_km')],
+}
+
+
+def drop_obsolete_indexes():
+    """Удаление индексов из OBSOLETE_INDEXES, оставшихся в существующих таблицах"""
+    migrator = MySQLMigrator(database_connection)
+    for model, obsolete in OBSOLETE_INDEXES.items():
+        table_name = model._meta.table_name
+        for index in database_connection.get_indexes(table_name):
+            if tuple(index.columns) not in obsolete:
+                continue
+            try:
+                migrate(migrator.drop_index(table_name, index.name))
+                print(f'Index {index.name} is dropped')
+            except Exception as e:
+                print(f'Error dropping index {index.name}: {e}')
+
+
+def migrate_car_catalog():
+    """Заполнение витрины каталога: первичное или по флагу CAR_CATALOG_REBUILD"""
+    if not CAR_CATALOG_REBUILD and CarCatalog.select().count() >= Cars.select().count():
+        return
+    CarCatalog.refresh()
+    print('Car catalog is filled')
+
+
 def initialize_database():
     try:
         database_connection.connect()
@@ -134,6 +321,11 @@ def initialize_database():
             tables,
             safe=True
         )
+        migrate_indexes()
+        drop_obsolete_indexes()
+        migrate_search_index()
+        migrate_vin_registry()
+        migrate_car_catalog()
         print('Tables is initialized')
     except Exception as e:
         print(f'Error initializing tables: {e}')
@@ -0,0 +1,95 @@
+"""Постраничная выдача списков по ключу (keyset pagination).
+
+Вместо OFFSET следующая страница выбирается условием "после последней
+записи предыдущей страницы" по полям сортировки, поэтому любая страница
+читается по индексу так же быстро, как первая. Курсор - это значения
+полей сортировки последней записи, закодированные в base64.
+"""
+import base64
+import json
+import operator
+from functools import reduce
+from typing import Optional
+
+from fastapi import HTTPException
+from peewee import Field, ForeignKeyField, IntegerField, FloatField, DecimalField, CharField, TextField
+
+from config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _cursor_types(field) -> tuple:
+    """Допустимые типы значения курсора для поля сортировки"""
+    while isinstance(field, ForeignKeyField):
+        field = field.rel_field
+    if isinstance(field, IntegerField):
+        return (int,)
+    if isinstance(field, (FloatField, DecimalField)):
+        return (int, float)
+    if isinstance(field, (CharField, TextField)):
+        return (str,)
+    return (str, int, float)
+
+
+def decode_cursor(cursor: str, fields: list) -> list:
+    """Значения полей сортировки из курсора; 400, если курсор не подходит к fields"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(400, 'Некорректный курсор страницы')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise HTTPException(400, 'Некорректный курсор страницы')
+    for value, field in zip(values, fields):
+        # bool - подкласс int, но в курсоре его быть не может
+        types = _cursor_types(field) if isinstance(field, Field) else (str, int, float)
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise HTTPException(400, 'Некорректный курсор страницы')
+    return values
+
+
+def page_size(limit: Optional[int]) -> int:
+    """Размер страницы с учетом ограничения MAX_PAGE_SIZE"""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def keyset_condition(fields: list, values: list, descending: bool = False):
+    """Условие "запись идет после values" при сортировке по fields"""
+    compare = operator.lt if descending else operator.gt
+    conditions = []
+    for position, field in enumerate(fields):
+        equal_prefix = [fields[i] == values[i] for i in range(position)]
+        conditions.append(reduce(operator.and_, equal_prefix + [compare(field, values[position])]))
+    return reduce(operator.or_, conditions)
+
+
+def row_value(row, field):
+    if isinstance(row, dict):
+        return row[field.name]
+    return getattr(row, field.name)
+
+
+def paginate(query, fields: list, cursor: Optional[str], limit: Optional[int],
+             descending: bool = False):
+    """Одна страница запроса, отсортированного по fields (последнее - уникальный ключ).
+
+    Возвращает список строк страницы и курсор следующей страницы (None на последней).
+    """
+    size = page_size(limit)
+    if cursor:
+        query = query.where(keyset_condition(fields, decode_cursor(cursor, fields), descending))
+    ordering = [field.desc() if descending else field.asc() for field in fields]
+    rows = list(query.order_by(*ordering).limit(size + 1))
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor([row_value(rows[-1], field) for field in fields])
+    return rows, next_cursor
+
+
+def page_response(items: list, next_cursor: Optional[str]) -> dict:
+    return {"items": items, "next_cursor": next_cursor}
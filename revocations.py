@@ -0,0 +1,94 @@
+"""Журнал отзыва токенов, общий для всех процессов API.
+
+Выход из системы и удаление пользователя обрабатывает один процесс, а
+токен могут предъявить любому. Поэтому отзыв дописывается строкой в файл
+в общем каталоге REVOCATIONS_DIR, а каждый процесс перед проверкой токена
+дочитывает появившиеся строки. Файлы разбиты на периоды длиной во время
+жизни токена: запись нужна не дольше этого срока, поэтому читаются только
+текущий и предыдущий периоды, а более старые файлы удаляются.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from config import REVOCATIONS_DIR, TOKEN_LIFETIME_MINUTES
+from shared_dirs import private_directory
+
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationLog:
+    """Чтение и запись журнала отзыва; у каждого читателя свои позиции в файлах"""
+
+    def __init__(self, directory: str = REVOCATIONS_DIR, period: float = TOKEN_LIFETIME_MINUTES * 60):
+        self.directory = directory
+        self.period = period
+        self._offsets = {}
+        self._period_seen = None
+        self._lock = threading.Lock()
+        if directory:
+            private_directory(directory)
+
+    def _period(self) -> int:
+        return int(time.time() // self.period)
+
+    def _path(self, period: int) -> str:
+        return os.path.join(self.directory, f"{period}.log")
+
+    def append(self, kind: str, key, at: float):
+        """Записать отзыв для всех процессов"""
+        if not self.directory:
+            return
+        line = json.dumps({"kind": kind, "key": key, "at": at}, separators=(",", ":")) + "\n"
+        # Короткая запись с O_APPEND не перемешивается с записями других процессов
+        fd = os.open(self._path(self._period()), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def read_new(self) -> list:
+        """Записи [(kind, key, at)], появившиеся с прошлого вызова, включая свои"""
+        if not self.directory:
+            return []
+        current = self._period()
+        entries = []
+        with self._lock:
+            if current != self._period_seen:
+                self._remove_old(current)
+                self._period_seen = current
+            for period in (current - 1, current):
+                path = self._path(period)
+                offset = self._offsets.get(path, 0)
+                try:
+                    if os.stat(path).st_size <= offset:
+                        continue
+                    with open(path, "rb") as file:
+                        file.seek(offset)
+                        data = file.read()
+                except FileNotFoundError:
+                    continue
+                # Недописанную последнюю строку дочитаем в следующий раз
+                complete = data.rfind(b"\n") + 1
+                self._offsets[path] = offset + complete
+                for line in data[:complete].splitlines():
+                    try:
+                        entry = json.loads(line)
+                        entries.append((entry["kind"], entry["key"], entry["at"]))
+                    except (ValueError, KeyError):
+                        logger.warning("Пропущена поврежденная запись журнала отзыва в %s", path)
+        return entries
+
+    def _remove_old(self, current: int):
+        for name in os.listdir(self.directory):
+            period, _, extension = name.partition(".")
+            if extension != "log" or not period.isdigit() or int(period) >= current - 1:
+                continue
+            self._offsets.pop(os.path.join(self.directory, name), None)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,229 @@
+"""Кэш сессий пользователей в памяти процесса"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from peewee import Case, chunked
+
+from config import (
+    SESSION_CACHE_SIZE,
+    SESSION_CACHE_TTL,
+    MAX_SESSIONS_PER_USER,
+    TOKEN_REAPER_BATCH_SIZE,
+)
+from database import database_connection
+from models import UserToken
+from revocations import RevocationLog
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedSession(NamedTuple):
+    user_id: int
+    role: Optional[str]
+    expires_at: datetime
+    cached_until: float
+
+
+class SessionCache:
+    """LRU-кэш токен -> (пользователь, роль, срок действия) с ограниченным временем жизни.
+
+    Удаление токена или пользователя из кэша записывается в общий журнал
+    отзыва, и другие процессы API убирают их из своих кэшей при следующей
+    проверке токена. В журнал попадает хеш токена, а не сам токен.
+    """
+
+    def __init__(self, max_size: int, ttl: int, log: RevocationLog):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.log = log
+        self._sessions = OrderedDict()
+        self._tokens_by_user = {}
+        self._tokens_by_hash = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[CachedSession]:
+        self.sync()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                self.misses += 1
+                return None
+            if session.cached_until < time.monotonic() or session.expires_at <= datetime.now():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(token)
+            self.hits += 1
+            return session
+
+    def put(self, token: str, user_id: int, role: Optional[str], expires_at: datetime) -> CachedSession:
+        session = CachedSession(user_id, role, expires_at, time.monotonic() + self.ttl)
+        with self._lock:
+            self._remove(token)
+            self._sessions[token] = session
+            self._tokens_by_user.setdefault(user_id, set()).add(token)
+            self._tokens_by_hash[self._hash(token)] = token
+            while len(self._sessions) > self.max_size:
+                oldest_token = next(iter(self._sessions))
+                self._remove(oldest_token)
+        return session
+
+    def invalidate(self, token: str):
+        """Удалить токен из кэша (выход из системы) во всех процессах"""
+        with self._lock:
+            self._remove(token)
+        self.log.append("session", self._hash(token), time.time())
+
+    def invalidate_user(self, user_id: int):
+        """Удалить все токены пользователя (удаление профиля, смена роли) во всех процессах"""
+        self._remove_user(user_id)
+        self.log.append("user", user_id, time.time())
+
+    def _remove_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def sync(self):
+        """Убрать из кэша токены и пользователей, отозванные другими процессами"""
+        for kind, key, _ in self.log.read_new():
+            if kind == "session":
+                with self._lock:
+                    token = self._tokens_by_hash.get(key)
+                    if token is not None:
+                        self._remove(token)
+            elif kind == "user":
+                self._remove_user(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._sessions),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def _remove(self, token: str):
+        session = self._sessions.pop(token, None)
+        if session is None:
+            return
+        self._tokens_by_hash.pop(self._hash(token), None)
+        tokens = self._tokens_by_user.get(session.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[session.user_id]
+
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL, RevocationLog())
+
+
+class TokenExtensions:
+    """Отложенные продления токенов, которые записываются в БД пачками"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, token: str, expires_at: datetime):
+        with self._lock:
+            self._pending[token] = expires_at
+
+    def discard(self, token: str):
+        with self._lock:
+            self._pending.pop(token, None)
+
+    def restore(self, pending: dict):
+        """Вернуть продления после неудачной записи, не затирая более свежие"""
+        with self._lock:
+            for token, expires_at in pending.items():
+                self._pending.setdefault(token, expires_at)
+
+    def pop_all(self) -> dict:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def __len__(self):
+        return len(self._pending)
+
+
+token_extensions = TokenExtensions()
+
+
+def flush_token_extensions(batch_size: int = 500) -> int:
+    """Записать накопленные продления токенов в БД, по одному UPDATE на пачку"""
+    pending = token_extensions.pop_all()
+    if not pending:
+        return 0
+    try:
+        with database_connection.connection_context():
+            for batch in chunked(pending.items(), batch_size):
+                tokens = [token for token, _ in batch]
+                (UserToken
+                 .update(expires_at=Case(UserToken.token, batch))
+                 .where(UserToken.token.in_(tokens))
+                 .execute())
+    except Exception:
+        logger.exception("Не удалось записать продления токенов")
+        token_extensions.restore(pending)
+        return 0
+    return len(pending)
+
+
+def enforce_session_limit(user_id: int):
+    """Удалить самые старые сессии пользователя сверх MAX_SESSIONS_PER_USER"""
+    if not MAX_SESSIONS_PER_USER:
+        return
+    extra_tokens = list(UserToken
+                        .select(UserToken.id, UserToken.token)
+                        .where(UserToken.user_id == user_id)
+                        .order_by(UserToken.created_at.desc(), UserToken.id.desc())
+                        .offset(MAX_SESSIONS_PER_USER)
+                        .tuples())
+    if not extra_tokens:
+        return
+    UserToken.delete().where(UserToken.id.in_([token_id for token_id, _ in extra_tokens])).execute()
+    for _, token in extra_tokens:
+        session_cache.invalidate(token)
+        token_extensions.discard(token)
+
+
+def reap_expired_tokens(batch_size: int = TOKEN_REAPER_BATCH_SIZE) -> int:
+    """Удалить просроченные токены небольшими порциями.
+
+    Каждая порция - отдельный короткий DELETE по первичному ключу, поэтому
+    очистка не держит долгих блокировок на таблице токенов.
+    """
+    removed = 0
+    try:
+        with database_connection.connection_context():
+            while True:
+                expired_ids = [token_id for token_id, in (UserToken
+                               .select(UserToken.id)
+                               .where(UserToken.expires_at < datetime.now())
+                               .limit(batch_size)
+                               .tuples())]
+                if not expired_ids:
+                    break
+                removed += UserToken.delete().where(UserToken.id.in_(expired_ids)).execute()
+                if len(expired_ids) < batch_size:
+                    break
+    except Exception:
+        logger.exception("Не удалось удалить просроченные токены")
+    return removed
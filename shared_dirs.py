@@ -0,0 +1,50 @@
+"""Каталоги состояния, общие для процессов API.
+
+По умолчанию они лежат во временном каталоге, куда может писать любой
+пользователь сервера. Чтобы чужой процесс не подменил каталог заранее
+(и не подложил туда свои записи отзыва или версии), каталог создается
+с правами 0o700, а уже существующий принимается, только если он
+принадлежит текущему пользователю и закрыт для записи остальным.
+"""
+import os
+import stat
+import tempfile
+
+
+def _current_uid():
+    return os.getuid() if hasattr(os, "getuid") else None
+
+
+def _check_private(path: str):
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f"{path} не является каталогом")
+    uid = _current_uid()
+    if uid is not None and info.st_uid != uid:
+        raise RuntimeError(f"Каталог {path} принадлежит другому пользователю")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError(f"Каталог {path} доступен для записи другим пользователям")
+
+
+def private_directory(path: str) -> str:
+    """Создать каталог с правами 0o700 или проверить существующий.
+
+    Внутри временного каталога проверяются и все промежуточные каталоги.
+    При подмене каталога - RuntimeError: лучше не запуститься, чем читать
+    чужие данные.
+    """
+    path = os.path.abspath(path)
+    temp_root = os.path.abspath(tempfile.gettempdir())
+    if os.path.commonpath([path, temp_root]) == temp_root and path != temp_root:
+        parts = os.path.relpath(path, temp_root).split(os.sep)
+        chain = [os.path.join(temp_root, *parts[:i + 1]) for i in range(len(parts))]
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        chain = [path]
+    for directory in chain:
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        _check_private(directory)
+    return path
@@ -0,0 +1,150 @@
+"""Подписанные токены доступа.
+
+Токен содержит id пользователя, роль и срок действия и подписан HMAC-SHA256,
+поэтому его проверка не требует обращения к БД. Отозванные токены (выход,
+удаление пользователя) хранятся в компактном списке в памяти процесса,
+записи из которого удаляются после истечения срока действия токенов.
+Другие процессы API узнают об отзыве из общего журнала (revocations.py).
+"""
+import base64
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+from uuid import uuid4
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, hmac
+
+from config import AUTH_MODE, AUTH_SECRET, TOKEN_LIFETIME_MINUTES
+from revocations import RevocationLog
+
+
+logger = logging.getLogger(__name__)
+
+if AUTH_SECRET:
+    _secret = AUTH_SECRET.encode()
+else:
+    if AUTH_MODE == "signed":
+        logger.warning("AUTH_SECRET не задан: токены будут действительны только в этом процессе")
+    _secret = os.urandom(32)
+
+
+class TokenClaims(NamedTuple):
+    user_id: int
+    role: Optional[str]
+    issued_at: float
+    expires_at: float
+    token_id: str
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: bytes) -> bytes:
+    signer = hmac.HMAC(_secret, hashes.SHA256())
+    signer.update(payload)
+    return signer.finalize()
+
+
+def issue_token(user_id: int, role: Optional[str], expires_at: float) -> str:
+    """Выпуск подписанного токена"""
+    payload = json.dumps({
+        "uid": user_id,
+        "role": role,
+        "iat": time.time(),
+        "exp": expires_at,
+        "jti": uuid4().hex,
+    }, separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def read_token(token: str) -> Optional[TokenClaims]:
+    """Проверка подписи, срока действия и отзыва токена"""
+    try:
+        payload_part, signature_part = token.split(".")
+        payload = _b64decode(payload_part)
+        verifier = hmac.HMAC(_secret, hashes.SHA256())
+        verifier.update(payload)
+        verifier.verify(_b64decode(signature_part))
+        data = json.loads(payload)
+        claims = TokenClaims(data["uid"], data["role"], data["iat"], data["exp"], data["jti"])
+    except (ValueError, KeyError, TypeError, InvalidSignature):
+        return None
+    if claims.expires_at <= time.time() or denylist.is_revoked(claims):
+        return None
+    return claims
+
+
+class Denylist:
+    """Отозванные токены и пользователи; записи живут не дольше самих токенов"""
+
+    def __init__(self, token_lifetime: float, log: RevocationLog):
+        self.token_lifetime = token_lifetime
+        self.log = log
+        self._tokens = {}
+        self._users = {}
+        self._expiry_heap = []
+        self._lock = threading.Lock()
+
+    def revoke_token(self, claims: TokenClaims):
+        self._add_token(claims.token_id, claims.expires_at)
+        self.log.append("token", claims.token_id, claims.expires_at)
+
+    def revoke_user(self, user_id: int):
+        """Отозвать все токены пользователя, выпущенные до текущего момента"""
+        now = time.time()
+        self._add_user(user_id, now)
+        self.log.append("user", user_id, now)
+
+    def _add_token(self, token_id: str, expires_at: float):
+        with self._lock:
+            self._tokens[token_id] = expires_at
+            heapq.heappush(self._expiry_heap, (expires_at, "token", token_id))
+            self._prune()
+
+    def _add_user(self, user_id: int, revoked_at: float):
+        with self._lock:
+            if self._users.get(user_id, 0) >= revoked_at:
+                return
+            self._users[user_id] = revoked_at
+            heapq.heappush(self._expiry_heap, (revoked_at + self.token_lifetime, "user", user_id))
+            self._prune()
+
+    def sync(self):
+        """Применить отзывы, записанные другими процессами"""
+        for kind, key, at in self.log.read_new():
+            if kind == "token" and at > time.time():
+                self._add_token(key, at)
+            elif kind == "user":
+                self._add_user(key, at)
+
+    def is_revoked(self, claims: TokenClaims) -> bool:
+        self.sync()
+        with self._lock:
+            if claims.token_id in self._tokens:
+                return True
+            revoked_at = self._users.get(claims.user_id)
+            return revoked_at is not None and claims.issued_at <= revoked_at
+
+    def __len__(self):
+        return len(self._tokens) + len(self._users)
+
+    def _prune(self):
+        now = time.time()
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, kind, key = heapq.heappop(self._expiry_heap)
+            entries = self._tokens if kind == "token" else self._users
+            if kind == "token" or entries.get(key, 0) + self.token_lifetime <= expires_at:
+                entries.pop(key, None)
+
+
+denylist = Denylist(TOKEN_LIFETIME_MINUTES * 60, RevocationLog())
@@ -0,0 +1,229 @@
+"""Потоковая выдача результатов запроса через серверный курсор.
+
+Запрос выполняется в отдельном потоке через SSCursor pymysql: строки
+читаются с сервера порциями по мере отправки клиенту, а между потоками
+лежит ограниченная очередь, поэтому память не зависит от размера таблицы.
+Те же строки можно отдать JSON-массивом, CSV или NDJSON, при необходимости
+сжимая их gzip по ходу выдачи.
+"""
+import csv
+import io
+import itertools
+import json
+import logging
+import queue
+import threading
+import zlib
+from datetime import date, datetime
+
+from pymysql.connections import Connection as MySQLConnection
+from pymysql.cursors import SSCursor
+
+from fastapi import HTTPException
+
+from config import STREAM_BATCH_SIZE, STREAM_QUEUE_SIZE, STREAM_MAX_CONCURRENT
+from database import database_connection
+
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+# Сколько секунд ждать, пока клиент заберет очередную порцию
+_PUT_TIMEOUT = 60
+# Как часто читающая сторона проверяет, что поток-производитель еще жив
+_GET_TIMEOUT = 1
+
+# Каждая выдача держит соединение из пула, пока не дочитана до конца
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONCURRENT)
+
+
+class StreamAborted(RuntimeError):
+    """Выдача прервана, не дойдя до конца результата"""
+
+
+def _open_cursor(connection):
+    if isinstance(connection, MySQLConnection):
+        return connection.cursor(SSCursor)
+    return connection.cursor()
+
+
+class _QueryRows:
+    """Строки запроса; поток чтения запускается при начале итерации"""
+
+    def __init__(self, query, batch_size: int):
+        self._query = query
+        self._batch_size = batch_size
+        self._started = False
+        # Имена столбцов результата; известны, когда запрос выполнен
+        self.columns = None
+
+    def __iter__(self):
+        self._started = True
+        batches = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        stop = threading.Event()
+        done = threading.Event()
+        threading.Thread(target=self._produce, args=(batches, stop, done), daemon=True).start()
+        return self._consume(batches, stop, done)
+
+    def __del__(self):
+        if not self._started:
+            _stream_slots.release()
+
+    @staticmethod
+    def _put(batches, stop, item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                logger.warning("Клиент не забирает данные, потоковая выдача прервана")
+                stop.set()
+        return False
+
+    def _produce(self, batches, stop, done):
+        finished = False
+        try:
+            database_connection.connect(reuse_if_open=True)
+            cursor = _open_cursor(database_connection.connection())
+            sql, params = self._query.sql()
+            cursor.execute(sql, params)
+            columns = self.columns = [column[0] for column in cursor.description]
+            while not stop.is_set():
+                rows = cursor.fetchmany(self._batch_size)
+                if not rows:
+                    finished = True
+                    break
+                if not self._put(batches, stop, [dict(zip(columns, row)) for row in rows]):
+                    break
+            if finished:
+                cursor.close()
+        except Exception as exc:
+            finished = False
+            self._put(batches, stop, exc)
+        finally:
+            try:
+                if finished:
+                    database_connection.close()
+                elif hasattr(database_connection, "manual_close"):
+                    # Недочитанный серверный курсор занимает соединение:
+                    # закрываем его, а не возвращаем в пул.
+                    database_connection.manual_close()
+                else:
+                    database_connection.close()
+            finally:
+                if finished:
+                    self._put(batches, stop, _DONE)
+                # После done в очередь больше ничего не попадет: читающая
+                # сторона, не найдя _DONE, узнает, что выдача оборвана.
+                done.set()
+                _stream_slots.release()
+
+    @staticmethod
+    def _consume(batches, stop, done):
+        try:
+            while True:
+                try:
+                    item = batches.get(timeout=_GET_TIMEOUT)
+                except queue.Empty:
+                    if done.is_set() and batches.empty():
+                        raise StreamAborted("Потоковая выдача прервана: данные слишком долго не забирали")
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+        finally:
+            stop.set()
+
+
+def iter_query_rows(query, batch_size: int = STREAM_BATCH_SIZE):
+    """Строки запроса в виде словарей {имя столбца: значение}, порциями с сервера.
+
+    Слот выдачи занимается сразу: если все STREAM_MAX_CONCURRENT заняты - 503.
+    """
+    if not _stream_slots.acquire(blocking=False):
+        raise HTTPException(503, "Слишком много одновременных выгрузок, повторите запрос позже")
+    return _QueryRows(query, batch_size)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_json_array(rows, format_row=None, batch_size: int = STREAM_BATCH_SIZE):
+    """JSON-массив из строк, отдаваемый кусками по batch_size элементов"""
+    yield "["
+    separator = ""
+    chunk = []
+    for row in rows:
+        item = format_row(row) if format_row else row
+        chunk.append(separator + json.dumps(item, ensure_ascii=False, default=_json_default))
+        separator = ","
+        if len(chunk) >= batch_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+    yield "]"
+
+
+def stream_ndjson(rows, format_row=None, batch_size: int = STREAM_BATCH_SIZE):
+    """NDJSON (по объекту на строку), кусками по batch_size строк"""
+    chunk = []
+    for row in rows:
+        item = format_row(row) if format_row else row
+        chunk.append(json.dumps(item, ensure_ascii=False, default=_json_default) + "\n")
+        if len(chunk) >= batch_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def stream_csv(rows, batch_size: int = STREAM_BATCH_SIZE):
+    """CSV с заголовком, кусками по batch_size строк.
+
+    Заголовок берется из rows.columns (столбцы результата запроса), поэтому
+    он есть и у пустой выдачи; у простого списка - из ключей первой строки.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    iterator = iter(rows)
+    first = next(iterator, None)
+    columns = getattr(rows, "columns", None)
+    if columns is None:
+        columns = list(first.keys()) if first is not None else []
+    if columns:
+        writer.writerow(columns)
+    if first is not None:
+        iterator = itertools.chain([first], iterator)
+    count = 0
+    for row in iterator:
+        writer.writerow([_csv_value(value) for value in row.values()])
+        count += 1
+        if count >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_stream(chunks):
+    """Сжать поток текстовых кусков в gzip, не накапливая его целиком"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
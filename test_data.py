@@ -1,5 +1,6 @@
 from database import database_connection
 from models import Users, Roles, UserRoles, Stamp, ModelCar, Status, Cars, Anketa, Shopping, Sales
+import inventory
 from argon2 import PasswordHasher
 import re
 from datetime import datetime, timedelta
@@ -227,6 +228,7 @@ def seed_database():
             {"stamp_id": bmw_stamp, "model_car_id": three_series_model, "run_km": 44000, "vin": "WBA8E9C58J8123418", "status_id": sold_status, "price": 2650000, "description": "Спортивный седан, задний привод, продан"}
         ]
         
+        created_car_ids = []
         for car_data in cars_data:
             car, created = Cars.get_or_create(
                 vin=car_data["vin"],
@@ -234,9 +236,12 @@ def seed_database():
             )
             
             if created:
+                created_car_ids.append(car.id)
                 print(f"   ✅ Автомобиль {car_data['stamp_id'].stamp} {car_data['model_car_id'].model_car} создан")
             else:
                 print(f"   ℹ️  Автомобиль с VIN {car_data['vin']} уже существует")
+        # Витрина каталога и поиск обновляются вместе с журналом изменений
+        inventory.record_car_changes(created_car_ids, inventory.ADDED)
         
         # 8. Проверка и добавление тестовых анкет (10+ записей)
         print("\n8. Проверка тестовых анкет...")
@@ -0,0 +1,78 @@
+"""Версии коллекций каталога для условных GET-запросов (ETag / If-None-Match).
+
+Каждая коллекция ("cars", "stamps", "models") имеет счетчик, который
+увеличивают изменяющие ее обработчики. Пока версия не изменилась, ответ
+списка тот же, и на запрос с совпадающим If-None-Match можно вернуть 304,
+не обращаясь к базе данных.
+"""
+import os
+import threading
+import time
+from typing import Optional
+from uuid import uuid4
+
+from config import VERSIONS_DIR
+from shared_dirs import private_directory
+
+
+CARS = "cars"
+STAMPS = "stamps"
+MODELS = "models"
+
+
+class CollectionVersions:
+    """Счетчики версий коллекций.
+
+    С каталогом (по умолчанию) версия - время изменения файла коллекции,
+    общее для всех процессов API. Без каталога счетчики живут в памяти
+    процесса, что годится только для запуска в один процесс; идентификатор
+    запуска в версии не дает совпасть ETag после перезапуска.
+    """
+
+    def __init__(self, directory: str = VERSIONS_DIR):
+        self.directory = directory
+        self._boot_id = uuid4().hex[:8]
+        self._counters = {}
+        self._lock = threading.Lock()
+        if directory:
+            private_directory(directory)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, name: str) -> str:
+        """Текущая версия коллекции"""
+        if self.directory:
+            try:
+                return str(os.stat(self._path(name)).st_mtime_ns)
+            except FileNotFoundError:
+                return "0"
+        return f"{self._boot_id}.{self._counters.get(name, 0)}"
+
+    def bump(self, *names: str):
+        """Отметить изменение коллекций; вызывать после фиксации транзакции"""
+        for name in names:
+            if self.directory:
+                path = self._path(name)
+                with open(path, "a"):
+                    pass
+                now = time.time_ns()
+                os.utime(path, ns=(now, now))
+            else:
+                with self._lock:
+                    self._counters[name] = self._counters.get(name, 0) + 1
+
+    def etag(self, *names: str) -> str:
+        """ETag ответа, который зависит от перечисленных коллекций"""
+        return '"' + "-".join(f"{name}.{self.get(name)}" for name in names) + '"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Совпадает ли ETag с одним из значений заголовка If-None-Match"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+collection_versions = CollectionVersions()
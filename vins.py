@@ -0,0 +1,156 @@
+"""Проверка уникальности VIN по общему реестру автомобилей и анкет.
+
+Уникальность гарантирует уникальный индекс VinRegistry.vin: при гонке
+вставка второго VIN завершается IntegrityError. Перед обращением к БД VIN
+проверяется фильтром Блума в памяти процесса - для нового VIN (обычный
+случай) запрос не нужен, а при положительном ответе выполняется один
+запрос по индексу.
+"""
+import hashlib
+import logging
+import math
+import threading
+from typing import Optional
+
+from config import VIN_FILTER_CAPACITY, VIN_FILTER_ERROR_RATE
+from database import database_connection
+from models import VinRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Фильтр Блума для строк: ложные срабатывания возможны, пропуски - нет"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value: str):
+        positions = self._positions(value)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+    def clear(self):
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self.count = 0
+
+
+class VinFilter:
+    """Фильтр Блума по всем VIN реестра.
+
+    До загрузки (и в других процессах API до их перезапуска) фильтр может
+    не знать о новых VIN, поэтому отрицательный ответ используется только
+    для предварительной проверки, а не вместо уникального индекса.
+    """
+
+    def __init__(self, capacity: int = VIN_FILTER_CAPACITY, error_rate: float = VIN_FILTER_ERROR_RATE):
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.loaded = False
+        self.negatives = 0
+        self.probes = 0
+
+    @staticmethod
+    def _key(vin: str) -> str:
+        # Сравнение VIN в MySQL не учитывает регистр
+        return vin.strip().upper()
+
+    def load(self):
+        """Заполнить фильтр всеми VIN реестра"""
+        self.bloom.clear()
+        for vin, in VinRegistry.select(VinRegistry.vin).tuples().iterator():
+            self.bloom.add(self._key(vin))
+        self.loaded = True
+
+    def add(self, vin: str):
+        self.bloom.add(self._key(vin))
+
+    def might_contain(self, vin: str) -> bool:
+        if self.loaded and self._key(vin) not in self.bloom:
+            self.negatives += 1
+            return False
+        self.probes += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "vins": self.bloom.count,
+            "bits": self.bloom.size,
+            "hashes": self.bloom.hash_count,
+            "negatives": self.negatives,
+            "probes": self.probes,
+        }
+
+
+vin_filter = VinFilter()
+
+
+def load_vin_filter():
+    """Загрузка фильтра при старте API"""
+    try:
+        with database_connection.connection_context():
+            vin_filter.load()
+    except Exception as e:
+        logger.error("Не удалось загрузить фильтр VIN: %s", e)
+
+
+def find_vin(vin: str) -> Optional[dict]:
+    """Запись реестра для VIN ({"car_id", "anketa_id"}) или None, если VIN свободен"""
+    if not vin_filter.might_contain(vin):
+        return None
+    return (VinRegistry
+            .select(VinRegistry.car_id, VinRegistry.anketa_id)
+            .where(VinRegistry.vin == vin)
+            .dicts()
+            .first())
+
+
+def register_vin(vin: str, car_id: Optional[int] = None, anketa_id: Optional[int] = None):
+    """Занять VIN; при занятом VIN - IntegrityError. Вызывать в транзакции создания записи"""
+    VinRegistry.insert(vin=vin, car_id=car_id, anketa_id=anketa_id).execute()
+    vin_filter.add(vin)
+
+
+def assign_vin_to_car(vin: str, car_id: int):
+    """Передать VIN анкеты созданному по ней автомобилю"""
+    updated = (VinRegistry
+               .update(car_id=car_id, anketa_id=None)
+               .where(VinRegistry.vin == vin)
+               .execute())
+    if not updated:
+        register_vin(vin, car_id=car_id)
+
+
+def change_anketa_vin(old_vin: str, new_vin: str, anketa_id: int):
+    """Заменить VIN анкеты; при занятом новом VIN - IntegrityError"""
+    updated = VinRegistry.update(vin=new_vin).where(VinRegistry.vin == old_vin).execute()
+    if not updated:
+        register_vin(new_vin, anketa_id=anketa_id)
+    vin_filter.add(new_vin)
+
+
+def assign_vins_to_cars(car_ids: dict):
+    """Передать VIN анкет созданным по ним автомобилям: {vin: car_id}"""
+    if not car_ids:
+        return
+    VinRegistry.delete().where(VinRegistry.vin.in_(list(car_ids))).execute()
+    VinRegistry.insert_many([{"vin": vin, "car_id": car_id}
+                             for vin, car_id in car_ids.items()]).execute()